@@ -1,5 +1,9 @@
+from functools import partial
+
 from parse import parse_fasta
+from distances import distance_matrix, find_center
 from neighbor_join import construct_tree
+import nw_numpy
 
 START = -1
 INSERT = 0
@@ -7,7 +11,7 @@ DELETE = 1
 SUBSTITUTE = 2
 
 
-def pairwise(v, w, match, mismatch, indel):
+def pairwise(v, w, match, mismatch, indel, band=None):
     """
     Finds an pairwise distance of v and w using Needleman-Wunsch and taking gaps
     into consideration.
@@ -16,9 +20,17 @@ def pairwise(v, w, match, mismatch, indel):
     :param match: score for matches
     :param mismatch: score for mismatches
     :param indel: score for insertions and deletions
+    :param band: None to fill the whole matrix, or 'auto' or an initial band
+    width to only fill cells near the diagonal
     :return: a tuple (score, v_aligned, w_aligned) with the optimal score
     and aligned strings
     """
+    if band is not None:
+        score, path = nw_numpy.banded_align(
+            *nw_numpy.edit_table(v, w, match, mismatch, indel, True),
+            nw_numpy.band_width(band, v, w))
+        return (-int(score),) + nw_numpy.path_strings(path, v, w)
+
     m = len(v)
     n = len(w)
 
@@ -77,35 +89,42 @@ def pairwise(v, w, match, mismatch, indel):
 
 
 
-def findCenterSeq(listofSeq):
+def pairwise_score(v, w, match, mismatch, indel, band=None):
+    """
+    Finds the pairwise distance of v and w without building the alignment.
+    :return: the optimal score of pairwise(v, w, match, mismatch, indel, band)
+    """
+    return pairwise(v, w, match, mismatch, indel, band)[0]
+
+
+def findCenterSeq(listofSeq, band=None, workers=None, cache=None,
+                  prune=False, sample=None):
     """
     Finds the center sequence by taking the sequence with minimum of sum of edit
     distances.
     :param listofSeq: Sequences passed by parse.py
+    :param band: band option passed on to pairwise
+    :param workers: number of processes computing distances, None for one per
+    CPU; unused when pruning
+    :param cache: optional PairwiseCache of distances
+    :param prune: whether to compute distances one candidate at a time and
+    drop candidates that cannot be the center, instead of computing the
+    whole distance matrix
+    :param sample: if given, only consider this many randomly chosen
+    sequences as the center (implies prune)
     :return: the center sequence
     """
-    match = 0
-    mismatch = 3
-    indel = 1
-    
-    seqLen = len(listofSeq)
-    pwMatrix = [["-"]*seqLen for i in range(seqLen)]
-    
-    findMin = []
-    acc = 0
-    for seq in listofSeq:
-        for seq2 in listofSeq:
-            # in1 gives row, in2 gives column 
-            in1 = listofSeq.index(seq)
-            in2 = listofSeq.index(seq2)
-            pwMatrix[in1][in2] = pairwise(seq, seq2, match, mismatch, indel)
-            acc += pwMatrix[in1][in2][0]
-        findMin.append(acc)
-        acc = 0
-    
-    posSeq = findMin.index(min(findMin))
-    
-    print(pwMatrix)
+    distance = partial(pairwise_score, match=0, mismatch=3, indel=1,
+                       band=band)
+    if prune or sample is not None:
+        posSeq = find_center(dict(enumerate(listofSeq)), distance, sample,
+                             cache=cache)
+    else:
+        pwMatrix = distance_matrix(dict(enumerate(listofSeq)), distance,
+                                   workers, cache=cache)
+        posSeq = int(pwMatrix.matrix.sum(axis=1).argmin())
+
+        print(pwMatrix.matrix)
     return listofSeq[posSeq]
 
 
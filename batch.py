@@ -0,0 +1,249 @@
+"""
+Script to align many sequence families in one run.
+Usage: python3 batch.py SOURCE [-o batch_output] [--method progressive]
+                        [--distance exact] [--workers N] [--matrix NAME]
+
+SOURCE is a directory of FASTA files or a manifest listing one FASTA file
+per line, relative to the manifest; blank lines and lines starting with '#'
+are skipped. Families are aligned in a pool of worker processes, which load
+the scoring matrix once and keep it for every family they align. The largest
+files go first, so that a big family does not start last and hold up the
+end of the run.
+
+Each family's alignment is written to OUTPUT/<name>.msa, one aligned row
+per line as progressive.py writes it, and its Sum-of-Pair score to
+OUTPUT/scores.tsv.
+"""
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from functools import partial
+import io
+import os
+import time
+
+from centerStar import centerStar_align, findCenterSeq
+from distances import distance_matrix
+from encoding import encode
+from neighbor_join import construct_tree
+from parallel_align import parallel_align
+from parse import parse_fasta
+from progressive import align_distance
+from sp_score import sp_score
+import kmer
+import matrices
+
+# Files of a directory taken as FASTA files
+FASTA_EXTENSIONS = ('.fasta', '.fa', '.faa', '.fas', '.txt')
+
+# Scoring matrix of a worker process
+_matrix = matrices.DEFAULT
+
+
+def list_families(source):
+    """
+    List the FASTA files of a batch.
+    :param source: a directory of FASTA files, or a manifest file
+    :return: the list of paths
+    :raises FileNotFoundError: if the source does not exist
+    """
+    if os.path.isdir(source):
+        return sorted(os.path.join(source, name)
+                      for name in os.listdir(source)
+                      if name.lower().endswith(FASTA_EXTENSIONS)
+                      and os.path.isfile(os.path.join(source, name)))
+
+    directory = os.path.dirname(source)
+    with open(source) as f:
+        return [os.path.join(directory, line.strip()) for line in f
+                if line.strip() and not line.startswith('#')]
+
+
+def largest_first(paths):
+    """
+    Order families by decreasing file size. The time to align a family grows
+    with its number of sequences and their lengths, both of which the file
+    size tracks.
+    :param paths: the FASTA files
+    :return: the sorted list of paths
+    """
+    return sorted(paths, key=_size, reverse=True)
+
+
+def _size(path):
+    # Missing files sort last and are reported when their turn comes
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return -1
+
+
+def _init_worker(matrix):
+    global _matrix
+    _matrix = matrix
+    # Load the matrix now rather than in the first family
+    matrices.scoring_matrix(matrix)
+    matrices.gap_scores(matrix)
+
+
+def align_family(sequences, method='progressive', distance='exact',
+                 matrix=matrices.DEFAULT):
+    """
+    Align one family in this process.
+    :param sequences: the dictionary of sequences
+    :param method: 'progressive' or 'center' for center star
+    :param distance: guide tree distances of the progressive method, 'exact'
+    or 'kmer'
+    :param matrix: the name of the scoring matrix
+    :return: a dictionary name -> aligned row, in the order of the rows of
+    the alignment
+    """
+    if len(sequences) == 1:
+        return dict(sequences)
+
+    if method == 'center':
+        center = findCenterSeq(sequences, workers=1, prune=True)
+        return centerStar_align(center, dict(sequences), matrix)
+
+    if distance == 'kmer':
+        D = kmer.kmer_distance_matrix(sequences)
+    else:
+        D = distance_matrix(sequences, partial(align_distance, matrix=matrix),
+                            workers=1)
+    root = construct_tree(D, sequences, dot_path=None)
+    profile, _ = parallel_align(root, sequences, 1, matrix)
+    return dict(zip(_leaf_order(root), profile.alignments))
+
+
+def _leaf_order(root):
+    # The rows of a progressive alignment follow the leaves from left to
+    # right
+    labels = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.children:
+            stack.extend(reversed(node.children))
+        else:
+            labels.append(node.label)
+    return labels
+
+
+def run_family(path, output, method, distance):
+    """
+    Align the family of a FASTA file and write its alignment; run in the
+    worker processes.
+    :param path: the FASTA file
+    :param output: the directory to write the alignment to
+    :param method: the alignment method, as for align_family()
+    :param distance: the guide tree distances, as for align_family()
+    :return: a dictionary with the family name, its number of sequences,
+    alignment columns, score and seconds, or with the error if it failed
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    start = time.perf_counter()
+    try:
+        sequences = parse_fasta(path)
+        if not sequences:
+            raise ValueError('no sequences')
+        for sequence in sequences.values():
+            encode(sequence)
+        # The aligners print progress dots, which would interleave between
+        # workers
+        with redirect_stdout(io.StringIO()):
+            rows = list(align_family(sequences, method, distance,
+                                     _matrix).values())
+    except (OSError, ValueError) as error:
+        return {'family': name, 'error': str(error)}
+
+    with open(os.path.join(output, name + '.msa'), 'w') as f:
+        f.write('\n'.join(rows))
+    return {'family': name, 'sequences': len(rows), 'columns': len(rows[0]),
+            'score': sp_score(rows, _matrix),
+            'seconds': time.perf_counter() - start}
+
+
+def run_batch(paths, output, method='progressive', distance='exact',
+              matrix=matrices.DEFAULT, workers=None):
+    """
+    Align a batch of families, the largest first.
+    :param paths: the FASTA files
+    :param output: the directory to write the alignments and scores to
+    :param method: 'progressive' or 'center'
+    :param distance: guide tree distances of the progressive method
+    :param matrix: the name of the scoring matrix
+    :param workers: the number of worker processes, None for one per CPU
+    :return: the list of family results, in the order they finished
+    """
+    os.makedirs(output, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(matrix,)) as executor:
+        futures = [executor.submit(run_family, path, output, method,
+                                   distance)
+                   for path in largest_first(paths)]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if 'error' in result:
+                print('{:30s} error: {}'.format(result['family'],
+                                                result['error']))
+            else:
+                print('{family:30s} {sequences:6d} sequences {columns:7d} '
+                      'columns  score {score:10d}  {seconds:8.2f} s'
+                      .format(**result))
+
+    with open(os.path.join(output, 'scores.tsv'), 'w') as f:
+        f.write('family\tsequences\tcolumns\tscore\tseconds\n')
+        for result in sorted(results, key=lambda result: result['family']):
+            if 'error' not in result:
+                f.write('{family}\t{sequences}\t{columns}\t{score}\t'
+                        '{seconds:.3f}\n'.format(**result))
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Align a batch of sequence families.')
+    parser.add_argument('source',
+                        help='a directory of FASTA files or a manifest '
+                             'listing them')
+    parser.add_argument('-o', '--output', default='batch_output',
+                        help='where to write the alignments and scores')
+    parser.add_argument('--method', choices=('progressive', 'center'),
+                        default='progressive',
+                        help='progressive or center star alignment')
+    parser.add_argument('--distance', choices=('exact', 'kmer'),
+                        default='exact',
+                        help='guide tree distances of progressive alignment')
+    parser.add_argument('--matrix', choices=sorted(matrices.MATRICES),
+                        default=matrices.DEFAULT,
+                        help='the scoring matrix')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, one per CPU by default')
+    args = parser.parse_args(argv)
+
+    try:
+        paths = list_families(args.source)
+    except FileNotFoundError:
+        parser.error('no such file or directory: {}'.format(args.source))
+    if not paths:
+        parser.error('no FASTA files in {}'.format(args.source))
+
+    start = time.perf_counter()
+    results = run_batch(paths, args.output, args.method, args.distance,
+                        args.matrix, args.workers)
+    minutes = (time.perf_counter() - start) / 60
+    failed = sum('error' in result for result in results)
+
+    print('Aligned {} families in {:.2f} min ({:.1f} families per minute)'
+          .format(len(results) - failed, minutes,
+                  (len(results) - failed) / minutes if minutes else 0))
+    if failed:
+        print('{} families failed'.format(failed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Benchmarks of the alignment pipeline stages.
+Usage: python3 benchmark.py [-n 8 16 32] [-L 100 200] [-d 0.1 0.3]
+                            [-o benchmark.json] [--nj]
+
+Synthetic protein families are generated by mutating a random root sequence
+along a random tree. Every stage of the pipelines is timed on each family
+of the grid and, unless --no-memory is given, run a second time under
+tracemalloc to record its peak memory. The results are written as JSON.
+"""
+
+import argparse
+from functools import partial
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from centerStar import centerStar_align
+from distances import distance_matrix, find_center
+from myers import edit_distance
+from neighbor_join import construct_tree
+from parse import parse_fasta
+from progressive import align_distance, multiple_align
+from sp_score import sp_score
+
+# The 20 standard amino acids
+AMINO_ACIDS = 'ARNDCQEGHILKMFPSTWYV'
+
+# Insertions and deletions happen at this fraction of the substitution rate
+INDEL_RATIO = 0.1
+
+
+def mutate(sequence, divergence, rng):
+    """
+    Mutate a sequence along one edge of the family tree.
+    :param sequence: the parent sequence
+    :param divergence: the probability of a substitution at each site;
+    insertions and deletions each happen at INDEL_RATIO times this rate
+    :param rng: the random.Random to draw from
+    :return: the child sequence
+    """
+    indel = divergence * INDEL_RATIO
+    child = []
+    for residue in sequence:
+        event = rng.random()
+        if event < indel:
+            continue
+        if event < 2 * indel:
+            child.append(rng.choice(AMINO_ACIDS))
+        elif event < 2 * indel + divergence:
+            residue = rng.choice(AMINO_ACIDS)
+        child.append(residue)
+
+    return ''.join(child) or rng.choice(AMINO_ACIDS)
+
+
+def random_family(n, length, divergence, seed=0):
+    """
+    Generate a protein family by splitting random leaves of a tree until it
+    has n leaves, mutating the sequence along every edge.
+    :param n: the number of sequences
+    :param length: the length of the root sequence
+    :param divergence: the substitution rate per edge
+    :param seed: the random seed
+    :return: a dictionary with name -> sequence
+    """
+    rng = random.Random(seed)
+    leaves = [''.join(rng.choice(AMINO_ACIDS) for _ in range(length))]
+    while len(leaves) < n:
+        parent = leaves.pop(rng.randrange(len(leaves)))
+        leaves.append(mutate(parent, divergence, rng))
+        leaves.append(mutate(parent, divergence, rng))
+
+    return {'SEQ{}'.format(k): sequence for k, sequence in enumerate(leaves)}
+
+
+def write_fasta(sequences, path):
+    """
+    Write sequences to a FASTA file, naming each record by its species tag.
+    """
+    with open(path, 'w') as f:
+        for name, sequence in sequences.items():
+            f.write('>synthetic protein [{}]\n'.format(name))
+            for k in range(0, len(sequence), 70):
+                f.write(sequence[k:k + 70] + '\n')
+
+
+def measure(function, *args, memory=True):
+    """
+    Time a function and record its peak memory.
+    :param function: the function to run
+    :param memory: whether to run it a second time under tracemalloc; the
+    timing run is never traced
+    :return: a tuple (result, seconds, peak_bytes), peak_bytes being None
+    without memory
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result, seconds, peak
+
+
+def bench_family(sequences, memory=True):
+    """
+    Run every pipeline stage on one family.
+    :param sequences: the dictionary of sequences
+    :param memory: whether to record peak memory
+    :return: a list of dictionaries with the stage, seconds and peak_bytes
+    """
+    results = []
+
+    def run(stage, function, *args):
+        result, seconds, peak = measure(function, *args, memory=memory)
+        results.append({'stage': stage, 'seconds': seconds,
+                        'peak_bytes': peak})
+        return result
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'family.fasta')
+        write_fasta(sequences, path)
+        sequences = run('parse_fasta', parse_fasta, path)
+
+    D = run('distance_matrix', distance_matrix, sequences, align_distance, 1)
+    root = run('construct_tree',
+               partial(construct_tree, dot_path=None), D, sequences)
+    profile = run('multiple_align', multiple_align, root, sequences)
+    run('sp_score', sp_score, profile.alignments)
+
+    center = run('find_center', find_center, sequences, edit_distance)
+    run('centerStar_align',
+        lambda: centerStar_align(center, dict(sequences)))
+
+    return results
+
+
+def bench_grid(sizes, lengths, divergences, seed=0, memory=True):
+    """
+    Run the pipeline benchmarks over a grid of synthetic families.
+    :param sizes: the numbers of sequences
+    :param lengths: the root sequence lengths
+    :param divergences: the substitution rates per tree edge
+    :param seed: the random seed of the families
+    :param memory: whether to record peak memory
+    :return: a list of result dictionaries, one per family and stage
+    """
+    results = []
+    for n in sizes:
+        for length in lengths:
+            for divergence in divergences:
+                sequences = random_family(n, length, divergence, seed)
+                for result in bench_family(sequences, memory):
+                    result.update(n=n, length=length,
+                                  divergence=divergence)
+                    results.append(result)
+                    print('n = {:4d}  L = {:5d}  d = {:.2f}  {:16s} '
+                          '{:8.3f} s'.format(n, length, divergence,
+                                             result['stage'],
+                                             result['seconds']))
+
+    return results
+
+
+def random_distances(n, seed=0):
+    """
+    Generate a random symmetric integer distance matrix.
+    :param n: the number of taxa
+    :param seed: the random seed
+    :return: a tuple (distances, names) with a dictionary (a, b) -> distance
+    and the list of taxa names
+    """
+    rng = random.Random(seed)
+    names = ['taxon{}'.format(i) for i in range(n)]
+    distances = {}
+    for i, a in enumerate(names):
+        distances[a, a] = 0
+        for b in names[i + 1:]:
+            distances[a, b] = distances[b, a] = rng.randint(1, 1000)
+
+    return distances, names
+
+
+def bench_construct_tree(sizes=(25, 50, 100, 200, 400)):
+    """
+    Time neighbor joining on random distance matrices of increasing size.
+    :param sizes: the numbers of taxa to try
+    :return: a list of (n, seconds) pairs
+    """
+    results = []
+    for n in sizes:
+        distances, names = random_distances(n)
+        start = time.perf_counter()
+        construct_tree(distances, names, dot_path=None)
+        results.append((n, time.perf_counter() - start))
+
+    return results
+
+
+def print_construct_tree():
+    print('construct_tree')
+    previous = None
+    for n, seconds in bench_construct_tree():
+        growth = '' if previous is None else '  (x{:.1f})'.format(
+            seconds / previous)
+        print('  n = {:4d}: {:8.3f} s{}'.format(n, seconds, growth))
+        previous = seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the alignment pipeline stages.')
+    parser.add_argument('-n', '--sizes', type=int, nargs='+',
+                        default=[8, 16, 32],
+                        help='numbers of sequences per family')
+    parser.add_argument('-L', '--lengths', type=int, nargs='+',
+                        default=[100, 200],
+                        help='root sequence lengths')
+    parser.add_argument('-d', '--divergences', type=float, nargs='+',
+                        default=[0.1, 0.3],
+                        help='substitution rates per tree edge')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the families')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the tracemalloc runs')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+                        help='where to write the JSON results')
+    parser.add_argument('--nj', action='store_true',
+                        help='only time neighbor joining on random '
+                             'distance matrices')
+    args = parser.parse_args(argv)
+
+    if args.nj:
+        print_construct_tree()
+        return
+
+    results = bench_grid(args.sizes, args.lengths, args.divergences,
+                         args.seed, not args.no_memory)
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'seed': args.seed,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to', args.output)
+
+
+if __name__ == '__main__':
+    main()
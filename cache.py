@@ -0,0 +1,115 @@
+"""
+Persistent cache of pairwise distances, shared between runs and pipelines.
+
+Entries are keyed by a hash of the scoring scheme and the two sequences and
+kept in an SQLite file. Once the cache holds more than max_entries, the least
+recently used entries are evicted.
+"""
+
+from hashlib import sha256
+import sqlite3
+
+CACHE_PATH = 'pairwise_cache.db'
+MAX_ENTRIES = 1000000
+
+
+class PairwiseCache:
+    def __init__(self, path=CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS pairs '
+                                '(key TEXT PRIMARY KEY, value REAL, '
+                                'used INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS pairs_used '
+                                'ON pairs (used)')
+        self.clock = self.connection.execute(
+            'SELECT COALESCE(MAX(used), 0) FROM pairs').fetchone()[0]
+
+    def __len__(self):
+        return self.connection.execute(
+            'SELECT COUNT(*) FROM pairs').fetchone()[0]
+
+    @staticmethod
+    def key(scheme, a, b):
+        """
+        Compute the cache key of a pair of sequences. Distances are symmetric,
+        so the order of a and b does not matter.
+        :param scheme: name of the scoring scheme
+        :param a: first sequence
+        :param b: other sequence
+        :return: the hex digest identifying the pair
+        """
+        a, b = sorted((a, b))
+        return sha256('\0'.join((scheme, a, b)).encode()).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Look up several keys at once.
+        :param keys: the keys to look up
+        :return: a dictionary key -> value of the keys found
+        """
+        found = {}
+        keys = list(keys)
+        for k in range(0, len(keys), 500):
+            batch = keys[k:k + 500]
+            found.update(self.connection.execute(
+                'SELECT key, value FROM pairs WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))), batch))
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        if found:
+            self.clock += 1
+            self.connection.executemany(
+                'UPDATE pairs SET used = ? WHERE key = ?',
+                ((self.clock, key) for key in found))
+            self.connection.commit()
+
+        return found
+
+    def get(self, scheme, a, b):
+        """
+        Look up the distance of a pair of sequences.
+        :return: the cached distance, or None if absent
+        """
+        return self.get_many([self.key(scheme, a, b)]).get(
+            self.key(scheme, a, b))
+
+    def put_many(self, items):
+        """
+        Store several distances at once, evicting the least recently used
+        entries if the cache grows past max_entries.
+        :param items: pairs (key, value)
+        """
+        self.clock += 1
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO pairs VALUES (?, ?, ?)',
+            ((key, value, self.clock) for key, value in items))
+
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            self.connection.execute(
+                'DELETE FROM pairs WHERE key IN '
+                '(SELECT key FROM pairs ORDER BY used LIMIT ?)', (excess,))
+        self.connection.commit()
+
+    def put(self, scheme, a, b, value):
+        """
+        Store the distance of a pair of sequences.
+        """
+        self.put_many([(self.key(scheme, a, b), value)])
+
+    def stats(self):
+        """
+        :return: a string summarizing the cache hits and misses
+        """
+        return '{} hits, {} misses, {} entries'.format(self.hits, self.misses,
+                                                       len(self))
+
+    def close(self):
+        self.connection.close()
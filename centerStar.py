@@ -1,33 +1,34 @@
-from parse import parse_fasta
-
-START = -1
-INSERT = 0
-DELETE = 1
-SUBSTITUTE = 2
-
+import argparse
+from functools import partial
 
-# Load in BLOSUM62 matrix
-with open('blosum62.txt') as f:
-    blosum_file = f.readlines()
+import numpy as np
 
-proteins = blosum_file[0].split()
+from parse import parse_fasta
+from cache import CACHE_PATH, PairwiseCache
+from distances import distance_matrix, find_center
+from myers import edit_distance
+import matrices
+import nw_numpy
+from sp_score import sp_score
 
-blosum = {}
-for line in blosum_file[1:]:
-    line = line.split()
-    for index, entry in enumerate(line[1:]):
-        blosum[line[0], proteins[index]] = int(entry)
 
-    
-def pairwise(string_v, string_w):
+def pairwise(string_v, string_w, band=None):
     """
     Finds an pairwise distance of v and w using Needleman-Wunsch and taking gaps
     into consideration.
     :param string_v: first string to align
     :param string_w: other string to align
+    :param band: None to fill the whole matrix, or 'auto' or an initial band
+    width to only fill cells near the diagonal
     :return: a tuple (score, v_aligned, w_aligned) with the optimal score
     and aligned strings
     """
+    if band is not None:
+        score, _ = nw_numpy.banded_align(
+            *nw_numpy.edit_table(string_v, string_w, 0, 1, 1),
+            nw_numpy.band_width(band, string_v, string_w))
+        return -int(score)
+
     m = len(string_v)
     n = len(string_w)
 
@@ -57,190 +58,127 @@ def pairwise(string_v, string_w):
 
     return D[m][n]
 
-def findCenterSeq(dictofSeq):
+def findCenterSeq(dictofSeq, band=None, distance=edit_distance, workers=None,
+                  cache=None, prune=False, sample=None):
     """
     Finds the center sequence by taking the sequence with minimum of sum of edit
     distances.
     :param dictofSeq: Sequences passed by parse.py
+    :param band: band option passed on to pairwise; when set, pairwise is used
+    instead of distance
+    :param distance: function computing the edit distance of two strings
+    :param workers: number of processes computing distances, None for one per
+    CPU; unused when pruning
+    :param cache: optional PairwiseCache of distances
+    :param prune: whether to compute distances one candidate at a time and
+    drop candidates that cannot be the center, instead of computing the
+    whole distance matrix
+    :param sample: if given, only consider this many randomly chosen
+    sequences as the center (implies prune)
     :return: the Name of center sequence
     """
-    seqLen = len(dictofSeq)
-    pwMatrix = [["-"]*seqLen for i in range(seqLen)]
-    listofSeq = []
-    for key in dictofSeq:
-        listofSeq.append(dictofSeq.get(key))
-    
-    findMin = []
-    acc = 0
-    for seq in listofSeq:
-        for seq2 in listofSeq:
-            # in1 gives row, in2 gives column 
-            in1 = listofSeq.index(seq)
-            in2 = listofSeq.index(seq2)
-            pwMatrix[in1][in2] = pairwise(seq, seq2)
-            acc += pwMatrix[in1][in2]
-            #TypeError: 'int' object is not subscriptable
-        findMin.append(acc)
-        acc = 0
-    posSeq = findMin.index(min(findMin))
-    refString = listofSeq[posSeq]
-    refName = ""
-    
-    for name, seq in dictofSeq.items():
-        if seq == refString:
-            refName = name
-    
+    if band is not None:
+        distance = partial(pairwise, band=band)
+
+    if prune or sample is not None:
+        refName = find_center(dictofSeq, distance, sample, cache=cache)
+    else:
+        pwMatrix = distance_matrix(dictofSeq, distance, workers, cache=cache)
+        refName = pwMatrix.names[int(pwMatrix.matrix.sum(axis=1).argmin())]
+
     print(refName)
-    
+
     return refName
 
-def sequence_align(string_v, string_w):
+def sequence_align(string_v, string_w, band=None, matrix=matrices.DEFAULT):
     """
     Finds an optimal global alignment of string v and string w using Needleman-Wunsch.
     :param string_v: first string to align
     :param string_w: other string to align
+    :param band: None to fill the whole matrix, or 'auto' or an initial band
+    width to only fill cells near the diagonal
+    :param matrix: the name of the scoring matrix
     :return: a tuple (v_aligned, w_aligned) of aligned strings
     """
-    m = len(string_v)
-    n = len(string_w)
-
-    # Initialization; D[i][j][0] contains the max alignment score of the
-    # ith prefix of v and the jth of w; D[i][j][1] contains the back pointer.
-    D = [[(0, START) for _ in range(n + 1)] for _ in range(m + 1)]
+    return nw_numpy.sequence_align(string_v, string_w, band, matrix)
 
-    for i in range(1, m + 1):
-        D[i][0] = (D[i - 1][0][0] + blosum['-', string_v[i - 1]], DELETE)
-
-    for j in range(1, n + 1):
-        D[0][j] = (D[0][j - 1][0] + blosum['-', string_w[j - 1]], INSERT)
-
-    # Recurrence
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            insert = D[i][j-1][0] + blosum['-', string_w[j - 1]]
-            delete = D[i-1][j][0] + blosum[string_v[i - 1], '-']
-            substitute = D[i-1][j-1][0] + blosum[string_v[i - 1], string_w[j - 1]]
-            # Set D[i][j] to the max of the recurrences
-            if insert > delete and insert > substitute:
-                D[i][j] = (insert, INSERT)
-            elif delete > substitute:
-                D[i][j] = (delete, DELETE)
-            else:
-                D[i][j] = (substitute, SUBSTITUTE)
-
-    i, j = m, n
-    v_aligned = ''
-    w_aligned = ''
-    back_pointer = D[i][j][1]
-    while back_pointer != START:
-        if back_pointer == INSERT:
-            j -= 1
-            v_aligned = '-' + v_aligned
-            w_aligned = string_w[j] + w_aligned
-
-            
-        elif back_pointer == DELETE:
-            i -= 1
-            v_aligned = string_v[i] + v_aligned
-            w_aligned = '-' + w_aligned
-
-        elif back_pointer == SUBSTITUTE:
-            i -= 1
-            j -= 1
-            v_aligned = string_v[i] + v_aligned
-            w_aligned = string_w[j] + w_aligned
-
-                    
-        back_pointer = D[i][j][1]
-        
-    return v_aligned, w_aligned
-
-def gap_align(center, string_w):
+def gap_align(center, string_w, matrix=matrices.DEFAULT):
     """
     Updates global alignment of string v and string w using Needleman-Wunsch.
     Prevents insertion during this alignment because string_v is always the center string.
     :param string_v: first string to align
     :param string_w: other string to align
+    :param matrix: the name of the scoring matrix
     :return: a tuple (v_aligned, w_aligned) of aligned strings
     """
-    m = len(center)
-    n = len(string_w)
-
-    # Initialization; D[i][j][0] contains the max alignment score of the
-    # ith prefix of v and the jth of w; D[i][j][1] contains the back pointer.
-    D = [[(0, START) for _ in range(n + 1)] for _ in range(m + 1)]
-
-    for i in range(1, m + 1):
-        D[i][0] = (D[i - 1][0][0] + blosum['-', center[i - 1]], DELETE)
-
-    for j in range(1, n + 1):
-        D[0][j] = (D[0][j - 1][0] + blosum['-', string_w[j - 1]], INSERT)
+    return nw_numpy.gap_align(center, string_w, matrix)
 
-    # Recurrence
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            delete = D[i-1][j][0] + blosum[center[i - 1], '-']
-            substitute = D[i-1][j-1][0] + blosum[center[i - 1], string_w[j - 1]]
-            # Set D[i][j] to the max of the recurrences
-            if delete > substitute:
-                D[i][j] = (delete, DELETE)
-            else:
-                D[i][j] = (substitute, SUBSTITUTE)
-
-    i, j = m, n
-    w_aligned = ''
-    back_pointer = D[i][j][1]
-    while back_pointer != START:
-        if back_pointer == DELETE:
-            i -= 1
-            w_aligned = '-' + w_aligned
-
-        elif back_pointer == SUBSTITUTE:
-            i -= 1
-            j -= 1
-            w_aligned = string_w[j] + w_aligned
-
-                    
-        back_pointer = D[i][j][1]
-        
-    return w_aligned
-
-def centerStar_align(refName, dictofSeq):
+def centerStar_align(refName, dictofSeq, matrix=matrices.DEFAULT):
     """
     Aligns all the sequences with Center Star MSA using Needleman-Wunsch.
-    :param refString: the center sequence
-    :param listofSeq: all the sequences need to be aligned
-    :return: a list of aligned sequences
+    Each sequence is aligned to the center as extended by the sequences
+    before it; the gaps that later sequences add to the center are then
+    merged into the earlier rows without aligning them again, so that every
+    row keeps the gaps of its own alignment to the center ("once a gap,
+    always a gap"). Before, the rows were aligned a second time to the final
+    center, which could move residues across the gaps added later and gave a
+    slightly different alignment.
+    :param refName: the name of the center sequence
+    :param dictofSeq: all the sequences need to be aligned
+    :param matrix: the name of the scoring matrix
+    :return: a dictionary of aligned sequences
     """
-    dictofFinalStr = {}
     refString = dictofSeq.pop(refName)
     #remove the center sequence from the list of sequence so it won't align to itself
     centerString = refString
     #construct a pointer to center squence
+    alignedStr = {}
+    centerColumns = {}
     for name in dictofSeq:
-        alignment = sequence_align(centerString, dictofSeq.get(name))
-        centerString = alignment[0]
-        #print(centerString)
-        strAligned = alignment[1]
-        #print(strAligned)
-        dictofFinalStr[name] = strAligned
-        #print(len(listofFinalStr))
-
-    for seq in dictofFinalStr:
-        #Aligns all the sequence to the final center sequence with all the gaps inserted
-        finalScore = gap_align(centerString, dictofFinalStr[seq])
-        finalStr = finalScore
-        dictofFinalStr[seq] = finalStr
-
+        path = nw_numpy.align_path(centerString, dictofSeq[name],
+                                   matrix=matrix)
+        centerString, alignedStr[name] = nw_numpy.path_strings(
+            path, centerString, dictofSeq[name])
+        #centerColumns[name][k] is the column of the new center holding
+        #column k of the center before this alignment
+        centerColumns[name] = np.flatnonzero(
+            np.array(path[::-1], dtype=np.uint8) != nw_numpy.INSERT)
+
+    #Spread every row over the columns of the final center, last row first,
+    #composing the column maps on the way back
+    length = len(centerString)
+    columns = np.arange(length)
+    dictofFinalStr = {}
+    for name in reversed(list(alignedStr)):
+        row = np.full(length, ord('-'), dtype=np.uint8)
+        row[columns] = np.frombuffer(alignedStr[name].encode('latin-1'),
+                                     dtype=np.uint8)
+        dictofFinalStr[name] = row.tobytes().decode('latin-1')
+        columns = columns[centerColumns[name]]
+
+    dictofFinalStr = {name: dictofFinalStr[name] for name in alignedStr}
     dictofFinalStr[refName] = (centerString)
     return dictofFinalStr
 
-def main():
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Center star multiple sequence alignment of COMP.txt.')
+    parser.add_argument('--cache', metavar='PATH', default=CACHE_PATH,
+                        help='the file caching distances between runs')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compute every distance, without reading or '
+                             'writing the cache')
+    args = parser.parse_args(argv)
+
     print('Reading fasta file...')
     sequences = parse_fasta('COMP.txt')
     
     print('Performing center star alignment...', end='', flush=True)
-    center = findCenterSeq(sequences)
+    cache = None if args.no_cache else PairwiseCache(args.cache)
+    center = findCenterSeq(sequences, cache=cache, prune=True)
+    if cache is not None:
+        print('Distance cache:', cache.stats())
+        cache.close()
     alignment = centerStar_align(center, sequences)
 
     with open('center_start_alignment.txt', 'w') as f:
@@ -250,5 +188,7 @@ def main():
     for name in alignment:
         print(alignment[name])
 
+    print('Sum-of-Pair Score:', sp_score(list(alignment.values())))
+
 if __name__ == '__main__':
     main()
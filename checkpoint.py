@@ -0,0 +1,181 @@
+"""
+Checkpoints of the progressive pipeline, so that a run that dies part way
+can be resumed.
+
+The pipeline runs in stages: parse, distances, tree, align and score. A
+checkpoint directory holds the result of every completed stage: the
+sequences as JSON, the distance matrix as a .npy array, the guide tree as
+Newick, and the profiles of the guide tree nodes aligned so far. state.json
+lists the completed stages along with a key identifying the input and
+options of the run; a checkpoint made with another key is discarded.
+
+Every file is written to a temporary file first and moved into place, so
+a run killed while saving leaves the previous state intact.
+"""
+
+from hashlib import sha1, sha256
+import json
+import os
+import pickle
+
+import numpy as np
+
+from distances import DistanceMatrix
+from neighbor_join import read_newick, to_newick
+
+STAGES = ('parse', 'distances', 'tree', 'align', 'score')
+
+
+def run_key(paths, **options):
+    """
+    Compute the key identifying a run.
+    :param paths: the input files of the run; None entries are skipped
+    :param options: the options that change the results
+    :return: the hex digest of the file contents and options
+    """
+    digest = sha256()
+    for path in paths:
+        if path is None:
+            continue
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(b'\0')
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _replace(path, write, mode='w'):
+    """
+    Write a file through a temporary file.
+    :param path: the file to write
+    :param write: a function writing the contents to an open file
+    :param mode: the mode to open the file in
+    """
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, mode) as f:
+        write(f)
+    os.replace(temporary, path)
+
+
+class Checkpoint:
+    def __init__(self, directory, key):
+        self.directory = directory
+        self.key = key
+        self.profiles = os.path.join(directory, 'profiles')
+        os.makedirs(self.profiles, exist_ok=True)
+
+        self.state = {'key': key, 'stages': {}}
+        try:
+            with open(self._path('state.json')) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+        if state is not None and state.get('key') == key:
+            self.state = state
+        else:
+            self.clear()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def clear(self):
+        """
+        Forget every completed stage and saved profile.
+        :return: nothing
+        """
+        for name in os.listdir(self.profiles):
+            os.remove(os.path.join(self.profiles, name))
+        self.state = {'key': self.key, 'stages': {}}
+        self._save_state()
+
+    def _save_state(self):
+        _replace(self._path('state.json'),
+                 lambda f: json.dump(self.state, f, indent=2))
+
+    def done(self, stage):
+        """
+        Check whether a stage has completed.
+        :param stage: the name of the stage, one of STAGES
+        :return: True if its result is saved
+        """
+        return stage in self.state['stages']
+
+    def complete(self, stage, **values):
+        """
+        Mark a stage as completed, once its result is saved.
+        :param stage: the name of the stage, one of STAGES
+        :param values: small results to keep in the state file
+        :return: nothing
+        """
+        self.state['stages'][stage] = values
+        self._save_state()
+
+    def value(self, stage, name):
+        """
+        Get a value saved by complete().
+        """
+        return self.state['stages'][stage][name]
+
+    def save_sequences(self, sequences):
+        _replace(self._path('sequences.json'),
+                 lambda f: json.dump(sequences, f))
+        self.complete('parse')
+
+    def load_sequences(self):
+        with open(self._path('sequences.json')) as f:
+            return json.load(f)
+
+    def save_distances(self, D):
+        _replace(self._path('distances.npy'),
+                 lambda f: np.save(f, np.asarray(D.matrix)), 'wb')
+        self.complete('distances', names=D.names)
+
+    def load_distances(self):
+        matrix = np.load(self._path('distances.npy'))
+        return DistanceMatrix(self.value('distances', 'names'), matrix)
+
+    def save_tree(self, root):
+        _replace(self._path('tree.nwk'),
+                 lambda f: f.write(to_newick(root) + '\n'))
+        self.complete('tree')
+
+    def load_tree(self):
+        return read_newick(self._path('tree.nwk'))
+
+    def _profile_path(self, label):
+        name = sha1(label.encode()).hexdigest()[:16]
+        return os.path.join(self.profiles, name + '.pkl')
+
+    def save_profile(self, node, packed):
+        """
+        Save the packed profile of an aligned guide tree node. The profiles
+        of its children are no longer needed and are removed.
+        :param node: the guide tree node
+        :param packed: its packed profile
+        :return: nothing
+        """
+        _replace(self._profile_path(node.label),
+                 lambda f: pickle.dump((node.label, packed), f), 'wb')
+        for child in node.children:
+            try:
+                os.remove(self._profile_path(child.label))
+            except FileNotFoundError:
+                pass
+
+    def saved_profiles(self):
+        """
+        Load the saved profiles.
+        :return: a dictionary node label -> packed profile
+        """
+        saved = {}
+        for name in os.listdir(self.profiles):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                with open(os.path.join(self.profiles, name), 'rb') as f:
+                    label, packed = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            saved[label] = packed
+        return saved
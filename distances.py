@@ -0,0 +1,216 @@
+"""
+All-pairs distance matrices shared by the progressive and center star
+pipelines.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import os
+import random
+import sys
+
+import numpy as np
+
+import metrics
+
+# Number of sequence pairs sent to a worker at a time
+CHUNK_SIZE = 8
+
+
+class DistanceMatrix:
+    def __init__(self, names, matrix):
+        self.names = list(names)
+        self.index = {name: k for k, name in enumerate(self.names)}
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, item):
+        a, b = item
+        return self.matrix[self.index[a], self.index[b]]
+
+    def row(self, name):
+        """
+        Get the distances from one sequence to all the others.
+        :param name: the name of the sequence
+        :return: an array of distances, in the order of self.names
+        """
+        return self.matrix[self.index[name]]
+
+
+# Sequences and distance function of a worker process
+_sequences = None
+_distance = None
+
+
+def _init_worker(sequences, distance, record=False):
+    global _sequences, _distance
+    _sequences = sequences
+    _distance = distance
+    metrics.start_worker(record)
+
+
+def _distances(pairs):
+    values = [_distance(_sequences[i], _sequences[j]) for i, j in pairs]
+    return values, metrics.take()
+
+
+def pair_distances(strings, pairs, distance, workers=None,
+                   chunk_size=CHUNK_SIZE):
+    """
+    Compute the distances of a list of pairs of sequences.
+    :param strings: the list of sequences
+    :param pairs: pairs (i, j) of indices into strings
+    :param distance: function computing the distance of two sequences; must
+    be picklable to run in worker processes
+    :param workers: the number of worker processes, None for one per CPU
+    :param chunk_size: the smallest number of pairs sent to a worker at a time
+    :return: the list of distances, in the order of pairs
+    """
+    if workers == 1 or len(pairs) <= chunk_size:
+        return [distance(strings[i], strings[j]) for i, j in pairs]
+
+    # Large jobs go out in a few chunks per worker to keep messaging cheap
+    processes = workers or os.cpu_count() or 1
+    chunk_size = max(chunk_size, len(pairs) // (4 * processes))
+    chunks = [pairs[k:k + chunk_size]
+              for k in range(0, len(pairs), chunk_size)]
+    values = []
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(strings, distance,
+                                       metrics.enabled)) as executor:
+        for chunk, recorded in executor.map(_distances, chunks):
+            values.extend(chunk)
+            metrics.merge(recorded)
+    return values
+
+
+def scheme_name(distance):
+    """
+    Name a distance function for use as a cache key, including the arguments
+    bound by functools.partial.
+    :param distance: the distance function
+    :return: a string naming the function
+    """
+    if isinstance(distance, partial):
+        return '{}({!r}, {!r})'.format(scheme_name(distance.func),
+                                       distance.args,
+                                       sorted(distance.keywords.items()))
+
+    module = distance.__module__
+    if module == '__main__':
+        path = getattr(sys.modules['__main__'], '__file__', module)
+        module = os.path.splitext(os.path.basename(path))[0]
+    return '{}.{}'.format(module, distance.__qualname__)
+
+
+def distance_matrix(sequences, distance, workers=None, chunk_size=CHUNK_SIZE,
+                    cache=None):
+    """
+    Compute the distances between all pairs of sequences. Distances are
+    assumed symmetric, so only the upper triangle is computed, and the
+    diagonal is zero.
+    :param sequences: the dictionary of sequences
+    :param distance: function computing the distance of two sequences; must
+    be picklable to run in worker processes
+    :param workers: the number of worker processes, None for one per CPU
+    :param chunk_size: the number of pairs sent to a worker at a time
+    :param cache: an optional PairwiseCache to look up and store distances
+    :return: a DistanceMatrix indexed by sequence name
+    """
+    names = list(sequences)
+    strings = [sequences[name] for name in names]
+    n = len(names)
+    pairs = [(i, j) for i in range(n) for j in range(i + 1, n)]
+    matrix = np.zeros((n, n))
+
+    known = {}
+    if cache is not None:
+        scheme = scheme_name(distance)
+        keys = {pair: cache.key(scheme, strings[pair[0]], strings[pair[1]])
+                for pair in pairs}
+        found = cache.get_many(set(keys.values()))
+        known = {pair: found[key] for pair, key in keys.items()
+                 if key in found}
+    missing = [pair for pair in pairs if pair not in known]
+    computed = pair_distances(strings, missing, distance, workers, chunk_size)
+
+    if cache is not None and missing:
+        cache.put_many((keys[pair], value)
+                       for pair, value in zip(missing, computed))
+
+    known.update(zip(missing, computed))
+    values = [known[pair] for pair in pairs]
+
+    if pairs:
+        rows, columns = zip(*pairs)
+        matrix[rows, columns] = values
+        matrix[columns, rows] = values
+
+    return DistanceMatrix(names, matrix)
+
+
+def find_center(sequences, distance, sample=None, seed=0, cache=None):
+    """
+    Find the sequence with the smallest sum of distances to all the others,
+    computing the distances one candidate at a time. A candidate is dropped
+    as soon as its partial sum exceeds the best complete sum so far, and
+    distances computed for earlier candidates are reused. Distances must be
+    symmetric and non-negative. Ties go to the first sequence, as with the
+    full distance matrix.
+    :param sequences: the dictionary of sequences
+    :param distance: function computing the distance of two sequences
+    :param sample: if given, only this many randomly chosen sequences are
+    considered as the center, which approximates the medoid of large sets
+    :param seed: the random seed of the sample
+    :param cache: an optional PairwiseCache to look up and store distances
+    :return: the name of the center
+    """
+    names = list(sequences)
+    strings = [sequences[name] for name in names]
+    n = len(names)
+    candidates = range(n)
+    if sample is not None and sample < n:
+        candidates = random.Random(seed).sample(candidates, sample)
+
+    # Sequences of typical length tend to be central, and a good candidate
+    # found early lets more of the others be dropped
+    lengths = [len(string) for string in strings]
+    median = sorted(lengths)[n // 2] if n else 0
+    candidates = sorted(candidates,
+                        key=lambda c: (abs(lengths[c] - median), c))
+
+    scheme = scheme_name(distance) if cache is not None else None
+    known = {}
+    best = None
+    best_total = float('inf')
+    for c in candidates:
+        pairs = [(min(c, j), max(c, j)) for j in range(n) if j != c]
+        if cache is not None:
+            keys = {pair: cache.key(scheme, strings[pair[0]], strings[pair[1]])
+                    for pair in pairs if pair not in known}
+            found = cache.get_many(set(keys.values()))
+            known.update((pair, found[key]) for pair, key in keys.items()
+                         if key in found)
+
+        # Distances known already count first, so that hopeless candidates
+        # are dropped before computing anything
+        total = sum(known[pair] for pair in pairs if pair in known)
+        computed = {}
+        for pair in pairs:
+            if total > best_total:
+                break
+            if pair not in known:
+                known[pair] = computed[pair] = distance(strings[pair[0]],
+                                                        strings[pair[1]])
+                total += known[pair]
+
+        if cache is not None and computed:
+            cache.put_many((keys[pair], value)
+                           for pair, value in computed.items())
+
+        if total < best_total or (total == best_total and c < best):
+            best, best_total = c, total
+
+    return names[best]
@@ -0,0 +1,78 @@
+"""
+Integer encoding of protein sequences.
+
+Residues are coded by their index in the scoring matrices (see matrices.py),
+so that scores are looked up by indexing an array instead of hashing
+character pairs.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+# The residues, in the order of the rows and columns of the scoring matrices
+PROTEINS = 'A R N D C Q E G H I L K M F P S T W Y V B Z X -'.split()
+
+# Residue codes: the index of each protein in the scoring matrices
+CODES = {protein: index for index, protein in enumerate(PROTEINS)}
+GAP = CODES['-']
+
+_LOOKUP = np.full(256, 255, dtype=np.uint8)
+for _protein, _code in CODES.items():
+    _LOOKUP[ord(_protein)] = _code
+_CHARACTERS = np.array([ord(protein) for protein in PROTEINS], dtype=np.uint8)
+
+
+class UnknownResidueError(ValueError):
+    """
+    Raised when a sequence contains a residue missing from the scoring
+    matrix.
+    """
+
+    def __init__(self, residue, position):
+        super().__init__('unknown residue {!r} at position {}'.format(
+            residue, position))
+        self.residue = residue
+        self.position = position
+
+
+@lru_cache(maxsize=4096)
+def encode(string):
+    """
+    Convert a sequence to an array of residue codes. Codes of recently used
+    sequences are cached, as all-pairs alignments encode every sequence many
+    times.
+    :param string: the sequence to encode
+    :return: a read-only uint8 array with one code per residue
+    :raises UnknownResidueError: if a residue has no code
+    """
+    codes = _LOOKUP[np.frombuffer(string.encode('latin-1'), dtype=np.uint8)]
+    if len(codes) > 0 and codes.max() == 255:
+        position = int(np.argmax(codes == 255))
+        raise UnknownResidueError(string[position], position)
+    codes.flags.writeable = False
+    return codes
+
+
+def encode_rows(rows):
+    """
+    Convert the rows of an alignment to an array of residue codes. Rows are
+    not cached, unlike single sequences.
+    :param rows: a list of aligned rows of the same length
+    :return: a uint8 array with one row of codes per aligned row
+    :raises UnknownResidueError: if a residue has no code
+    :raises ValueError: if the rows have different lengths
+    """
+    length = len(rows[0]) if rows else 0
+    if any(len(row) != length for row in rows):
+        raise ValueError('rows of different lengths in the alignment')
+    return encode.__wrapped__(''.join(rows)).reshape(len(rows), length)
+
+
+def decode(codes):
+    """
+    Convert an array of residue codes back to a sequence.
+    :param codes: the residue codes
+    :return: the sequence
+    """
+    return _CHARACTERS[codes].tobytes().decode('latin-1')
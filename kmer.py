@@ -0,0 +1,125 @@
+"""
+Fast approximate distances from shared k-tuple counts, for building guide
+trees without aligning every pair of sequences.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+from distances import DistanceMatrix
+from encoding import CODES, encode
+
+# Default k-tuple length
+K = 2
+
+# Longest k-tuple whose code fits in an int64
+MAX_K = 13
+
+
+def _tuples(sequence, k=K):
+    """
+    Encode the k-tuples of a sequence as integers.
+    :param sequence: the sequence
+    :param k: the length of the k-tuples
+    :return: an int64 array with the code of the k-tuple at every position
+    :raises ValueError: if k is not between 1 and MAX_K
+    """
+    if not 1 <= k <= MAX_K:
+        raise ValueError('k-tuple length must be between 1 and {}'.format(
+            MAX_K))
+    codes = encode(sequence).astype(np.int64)
+    if len(codes) < k:
+        return np.zeros(0, dtype=np.int64)
+    size = len(CODES)
+    tuples = np.zeros(len(codes) - k + 1, dtype=np.int64)
+    for offset in range(k):
+        tuples = tuples * size + codes[offset:len(codes) - k + 1 + offset]
+    return tuples
+
+
+@lru_cache(maxsize=1024)
+def kmer_counts(sequence, k=K):
+    """
+    Count the k-tuples of a sequence. Counts of recently used sequences are
+    cached, since all-vs-seeds distances reuse the seeds over and over.
+    :param sequence: the sequence to count
+    :param k: the length of the k-tuples
+    :return: a tuple (tuples, counts) with the sorted codes of the k-tuples
+    that occur and the number of times each occurs
+    """
+    return np.unique(_tuples(sequence, k), return_counts=True)
+
+
+def kmer_distance(v, w, k=K):
+    """
+    Compute the k-tuple distance of two sequences: one minus the fraction of
+    k-tuples of the shorter sequence that the two share.
+    :param v: first sequence
+    :param w: other sequence
+    :param k: the length of the k-tuples
+    :return: a distance between 0 and 1
+    """
+    tuples_v, counts_v = kmer_counts(v, k)
+    tuples_w, counts_w = kmer_counts(w, k)
+    _, in_v, in_w = np.intersect1d(tuples_v, tuples_w, assume_unique=True,
+                                   return_indices=True)
+    shared = np.minimum(counts_v[in_v], counts_w[in_w]).sum()
+    return 1 - shared / max(min(len(v), len(w)) - k + 1, 1)
+
+
+def kmer_distance_matrix(sequences, k=K):
+    """
+    Compute the k-tuple distances between all pairs of sequences, counting
+    the k-tuples of each sequence only once.
+
+    The rth occurrence of a k-tuple in one sequence is matched with the rth
+    occurrence in another, so the number of k-tuples two sequences share is
+    the number of (tuple, r) keys they have in common. Every key lists the
+    sequences that have it, and a sequence is compared with all the others
+    at once by counting the sequences listed under its keys. Memory is
+    linear in the total length of the sequences.
+    :param sequences: the dictionary of sequences
+    :param k: the length of the k-tuples
+    :return: a DistanceMatrix indexed by sequence name
+    """
+    names = list(sequences)
+    n = len(names)
+    lengths = np.array([len(sequences[name]) for name in names])
+    tuples = [_tuples(sequences[name], k) for name in names]
+    codes = np.concatenate(tuples) if tuples else np.zeros(0, np.int64)
+    owners = np.repeat(np.arange(n), [len(t) for t in tuples])
+
+    # Number the occurrences of each k-tuple within each sequence
+    order = np.lexsort((owners, codes))
+    codes, owners = codes[order], owners[order]
+    first = np.flatnonzero(np.r_[True, (codes[1:] != codes[:-1])
+                                 | (owners[1:] != owners[:-1])])
+    ranks = np.arange(len(codes)) - np.repeat(
+        first, np.diff(np.r_[first, len(codes)]))
+
+    # Group the occurrences by (tuple, rank) key
+    order = np.lexsort((owners, ranks, codes))
+    codes, owners, ranks = codes[order], owners[order], ranks[order]
+    new_key = np.r_[True, (codes[1:] != codes[:-1])
+                    | (ranks[1:] != ranks[:-1])]
+    key_starts = np.flatnonzero(new_key)
+    key_sizes = np.diff(np.r_[key_starts, len(codes)])
+    keys = np.cumsum(new_key) - 1
+
+    by_owner = np.argsort(owners, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(owners, minlength=n))]
+
+    matrix = np.zeros((n, n))
+    for i in range(n):
+        own = keys[by_owner[bounds[i]:bounds[i + 1]]]
+        sizes = key_sizes[own]
+        listed = np.repeat(key_starts[own] - np.cumsum(sizes) + sizes,
+                           sizes) + np.arange(sizes.sum())
+        shared = np.bincount(owners[listed], minlength=n)[i + 1:]
+        counted = np.maximum(np.minimum(lengths[i], lengths[i + 1:]) - k + 1,
+                             1)
+        matrix[i, i + 1:] = 1 - shared / counted
+        matrix[i + 1:, i] = matrix[i, i + 1:]
+
+    return DistanceMatrix(names, matrix)
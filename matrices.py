@@ -0,0 +1,95 @@
+"""
+Registry of the substitution matrices shipped with the aligners.
+
+Matrices are read from the text files next to this module the first time
+they are used, and a parsed copy is saved as a .npy file beside the text
+file so that later runs skip the parsing. In the text files the last row
+and column, '-', hold the scores against a gap.
+"""
+
+from functools import lru_cache
+import os
+
+import numpy as np
+
+from encoding import CODES, GAP
+
+DEFAULT = 'BLOSUM62'
+
+MATRICES = {
+    'BLOSUM45': 'blosum45.txt',
+    'BLOSUM62': 'blosum62.txt',
+    'BLOSUM80': 'blosum80.txt',
+    'PAM30': 'pam30.txt',
+    'PAM70': 'pam70.txt',
+    'PAM250': 'pam250.txt',
+}
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def _parse(path):
+    """
+    Parse a matrix text file into an array in residue code order.
+    :param path: the path to the text file
+    :return: an int64 array indexed by residue codes
+    """
+    with open(path) as f:
+        lines = [line.split() for line in f if line.strip()]
+
+    columns = [CODES[protein] for protein in lines[0]]
+    matrix = np.zeros((len(CODES), len(CODES)), dtype=np.int64)
+    for line in lines[1:]:
+        matrix[CODES[line[0]], columns] = [int(entry) for entry in line[1:]]
+
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def scoring_matrix(name=DEFAULT):
+    """
+    Get a substitution matrix, loading it on first use.
+    :param name: the name of the matrix, one of MATRICES
+    :return: a read-only int64 array indexed by residue codes
+    :raises ValueError: if there is no matrix with that name
+    """
+    if name not in MATRICES:
+        raise ValueError('unknown scoring matrix {!r}, expected one of {}'
+                         .format(name, ', '.join(sorted(MATRICES))))
+
+    path = os.path.join(_DIRECTORY, MATRICES[name])
+    cached = os.path.splitext(path)[0] + '.npy'
+    try:
+        if os.path.getmtime(cached) >= os.path.getmtime(path):
+            matrix = np.load(cached)
+        else:
+            matrix = None
+    except (OSError, ValueError):
+        matrix = None
+
+    if matrix is None:
+        matrix = _parse(path)
+        # Write to a temporary file first, as other processes may be
+        # loading the same matrix
+        temporary = '{}.{}.tmp'.format(cached, os.getpid())
+        try:
+            with open(temporary, 'wb') as f:
+                np.save(f, matrix)
+            os.replace(temporary, cached)
+        except OSError:
+            pass
+
+    matrix.flags.writeable = False
+    return matrix
+
+
+@lru_cache(maxsize=None)
+def gap_scores(name=DEFAULT):
+    """
+    Get the scores of every residue against a gap.
+    :param name: the name of the matrix, one of MATRICES
+    :return: a read-only int64 array indexed by residue codes
+    """
+    scores = scoring_matrix(name)[:, GAP].copy()
+    scores.flags.writeable = False
+    return scores
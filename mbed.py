@@ -0,0 +1,130 @@
+"""
+Guide trees for large sequence sets by embedding (after mBed, Blackshields
+et al. 2010).
+
+Each sequence is represented by its distances to a small set of seed
+sequences. The embedded points are split recursively with 2-means until the
+clusters are small, and each small cluster is joined with neighbor joining on
+the distances between embedded points. This needs O(n log^2 n) sequence
+distances instead of all n^2.
+"""
+
+from math import log2
+
+import numpy as np
+
+from distances import DistanceMatrix, pair_distances
+from neighbor_join import Node, construct_tree
+
+# Clusters of at most this many sequences are joined with neighbor joining
+LEAF_SIZE = 32
+
+# Iterations of 2-means per split
+ITERATIONS = 20
+
+
+def seed_indices(lengths, count):
+    """
+    Pick seed sequences evenly spread over the sequences sorted by length.
+    :param lengths: the length of every sequence
+    :param count: the number of seeds
+    :return: the indices of the seeds
+    """
+    by_length = np.argsort(lengths, kind='stable')
+    picks = np.linspace(0, len(lengths) - 1, count).round().astype(int)
+    return [int(by_length[k]) for k in np.unique(picks)]
+
+
+def embed(strings, distance, seeds=None, workers=None):
+    """
+    Embed sequences as their vectors of distances to seed sequences.
+    :param strings: the list of sequences
+    :param distance: function computing the distance of two sequences
+    :param seeds: the number of seeds, by default log2(n)^2
+    :param workers: the number of processes computing distances
+    :return: an n x seeds array of distances
+    """
+    n = len(strings)
+    if seeds is None:
+        seeds = int(log2(n) ** 2) if n > 1 else 1
+    seeds = seed_indices([len(string) for string in strings],
+                         max(1, min(seeds, n)))
+
+    pairs = [(i, seed) for i in range(n) for seed in seeds]
+    values = pair_distances(strings, pairs, distance, workers)
+    return np.array(values, dtype=float).reshape(n, len(seeds))
+
+
+def bisect(points):
+    """
+    Split points in two with 2-means, starting from two far apart points.
+    :param points: the array of points to split
+    :return: a boolean array marking the points of one of the halves
+    """
+    first = np.argmax(((points - points.mean(axis=0)) ** 2).sum(axis=1))
+    second = np.argmax(((points - points[first]) ** 2).sum(axis=1))
+    centers = points[[first, second]]
+
+    side = None
+    for _ in range(ITERATIONS):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_side = distances[:, 1] < distances[:, 0]
+        if side is not None and (new_side == side).all():
+            break
+        side = new_side
+        if side.all() or not side.any():
+            break
+        centers = np.array([points[~side].mean(axis=0),
+                            points[side].mean(axis=0)])
+
+    # Identical points cannot be told apart, so split them down the middle
+    if side.all() or not side.any():
+        side = np.arange(len(points)) >= len(points) // 2
+
+    return side
+
+
+def cluster_tree(names, points, leaf_size=LEAF_SIZE):
+    """
+    Build a guide tree over embedded points.
+    :param names: the names of the sequences
+    :param points: the embedded point of every sequence
+    :param leaf_size: the largest cluster joined with neighbor joining
+    :return: the root of the tree
+    """
+    if len(names) == 1:
+        return Node(names[0])
+
+    if len(names) <= leaf_size:
+        differences = points[:, None, :] - points[None, :, :]
+        distances = np.sqrt((differences ** 2).sum(axis=2))
+        return construct_tree(DistanceMatrix(names, distances), names,
+                              dot_path=None)
+
+    side = bisect(points)
+    left = cluster_tree([name for name, s in zip(names, side) if not s],
+                        points[~side], leaf_size)
+    right = cluster_tree([name for name, s in zip(names, side) if s],
+                         points[side], leaf_size)
+
+    root = Node(left.label + ',' + right.label)
+    root.add(left, right)
+    return root
+
+
+def mbed_tree(sequences, distance, seeds=None, leaf_size=LEAF_SIZE,
+              workers=None):
+    """
+    Create a guide tree by embedding the sequences and clustering them.
+    :param sequences: the dictionary of sequences
+    :param distance: function computing the distance of two sequences; must
+    be picklable to run in worker processes
+    :param seeds: the number of seed sequences, by default log2(n)^2
+    :param leaf_size: the largest cluster joined with neighbor joining
+    :param workers: the number of processes computing distances
+    :return: the root of the constructed tree
+    """
+    names = list(sequences)
+    points = embed([sequences[name] for name in names], distance, seeds,
+                   workers)
+    return cluster_tree(names, points, leaf_size)
@@ -0,0 +1,268 @@
+"""
+Lightweight instrumentation of the alignment pipelines.
+
+Metrics are off by default, and every recording function returns at once
+while they are. enable() turns them on and sends them to a file, either as
+JSON lines written as the run goes or as Prometheus text written by close().
+Recorded are stage durations, counters such as DP cells filled, peaks such
+as the largest back pointer matrix, and events such as the profile sizes at
+each guide tree node. A stage can also be run under cProfile.
+
+Only the process that called enable() writes metrics. Worker processes call
+start_worker() to count on their own, and hand their counters and peaks
+back with each result through take(), for the parent to merge().
+"""
+
+from contextlib import contextmanager, nullcontext
+import json
+import pstats
+import time
+
+from _lsprof import Profiler
+
+enabled = False
+
+_file = None
+_format = None
+_profiled = frozenset()
+_started = None
+_counters = {}
+_peaks = {}
+_stages = {}
+
+_NO_STAGE = nullcontext()
+
+
+def enable(path, format='jsonl', profile_stages=()):
+    """
+    Start recording metrics.
+    :param path: the file to write the metrics to
+    :param format: 'jsonl' or 'prometheus'
+    :param profile_stages: names of stages to run under cProfile; the
+    statistics of stage s are written to path + '.s.prof', to be read with
+    pstats
+    :return: nothing
+    """
+    global enabled, _file, _format, _profiled, _started
+    if format not in ('jsonl', 'prometheus'):
+        raise ValueError('unknown metrics format {!r}'.format(format))
+
+    close()
+    _file = open(path, 'w')
+    _format = format
+    _profiled = frozenset(profile_stages)
+    _started = time.perf_counter()
+    _counters.clear()
+    _peaks.clear()
+    _stages.clear()
+    enabled = True
+
+
+def start_worker(record):
+    """
+    Set up metrics in a worker process: counters and peaks are kept for the
+    parent to collect with take(), and nothing is written. A forked worker
+    inherits the parent's state, which is reset here.
+    :param record: whether the parent records metrics
+    :return: nothing
+    """
+    global enabled, _format, _profiled
+    # _file is left alone: dropping the inherited file object would flush
+    # the parent's buffered lines a second time
+    _format = None
+    _profiled = frozenset()
+    _counters.clear()
+    _peaks.clear()
+    _stages.clear()
+    enabled = record
+
+
+def take():
+    """
+    Collect the counters and peaks recorded since the last call, in a worker
+    process.
+    :return: a tuple (counters, peaks) of dictionaries, to pass to merge()
+    """
+    values = dict(_counters), dict(_peaks)
+    _counters.clear()
+    _peaks.clear()
+    return values
+
+
+def merge(values):
+    """
+    Add the counters and peaks collected by take() in a worker process.
+    :param values: the tuple returned by take()
+    :return: nothing
+    """
+    if enabled:
+        counters, peaks = values
+        for name, value in counters.items():
+            count(name, value)
+        for name, value in peaks.items():
+            peak(name, value)
+
+
+def count(name, value=1):
+    """
+    Add to a counter.
+    """
+    if enabled:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def peak(name, value):
+    """
+    Record a value of which only the maximum is kept.
+    """
+    if enabled and value > _peaks.get(name, value - 1):
+        _peaks[name] = value
+
+
+def event(name, **fields):
+    """
+    Record a single event with its fields; only written as JSON lines.
+    """
+    if enabled:
+        _write_line({'type': 'event', 'name': name, **fields})
+
+
+def stage(name):
+    """
+    Time a stage of a pipeline:
+
+        with metrics.stage('align'):
+            ...
+
+    :param name: the name of the stage
+    :return: a context manager
+    """
+    if not enabled:
+        return _NO_STAGE
+    return _stage(name)
+
+
+@contextmanager
+def _stage(name):
+    profiler = _Profiler() if name in _profiled else None
+
+    cells = _counters.get('dp_cells', 0)
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            pstats.Stats(profiler).dump_stats('{}.{}.prof'.format(
+                _file.name, name))
+        seconds = time.perf_counter() - start
+        _stages[name] = _stages.get(name, 0) + seconds
+        cells = _counters.get('dp_cells', 0) - cells
+        _write_line({'type': 'stage', 'name': name, 'seconds': seconds,
+                     'dp_cells': cells,
+                     'dp_cells_per_second': cells / seconds if seconds
+                     else 0})
+
+
+def _label(code):
+    if isinstance(code, str):
+        return '~', 0, code
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+class _Profiler(Profiler):
+    """
+    The profiler behind cProfile. cProfile itself cannot be imported here,
+    as it imports the standard profile module, which profile.py shadows.
+    """
+
+    def create_stats(self):
+        """
+        Convert the collected entries to the statistics read by pstats, as
+        cProfile.Profile does.
+        """
+        entries = self.getstats()
+        self.stats = {}
+        callers_of = {}
+        for entry in entries:
+            callers = {}
+            callers_of[id(entry.code)] = callers
+            self.stats[_label(entry.code)] = (
+                entry.callcount - entry.reccallcount, entry.callcount,
+                entry.inlinetime, entry.totaltime, callers)
+
+        for entry in entries:
+            for call in entry.calls or ():
+                callers = callers_of.get(id(call.code))
+                if callers is None:
+                    continue
+                caller = _label(entry.code)
+                totals = (call.callcount,
+                          call.callcount - call.reccallcount,
+                          call.inlinetime, call.totaltime)
+                if caller in callers:
+                    totals = tuple(a + b for a, b in zip(callers[caller],
+                                                         totals))
+                callers[caller] = totals
+
+
+def _write_line(record):
+    if _format == 'jsonl':
+        _file.write(json.dumps(record) + '\n')
+
+
+def summary():
+    """
+    Summarize the metrics recorded so far.
+    :return: a dictionary with the stage durations, counters, peaks and the
+    counter rates per second since enable()
+    """
+    elapsed = time.perf_counter() - _started if _started is not None else 0
+    return {
+        'seconds': elapsed,
+        'stages': dict(_stages),
+        'counters': dict(_counters),
+        'peaks': dict(_peaks),
+        'rates': {name: value / elapsed if elapsed else 0
+                  for name, value in _counters.items()},
+    }
+
+
+def _prometheus(values):
+    lines = ['# TYPE msa_run_seconds gauge',
+             'msa_run_seconds {}'.format(values['seconds']),
+             '# TYPE msa_stage_seconds gauge']
+    for name, seconds in values['stages'].items():
+        lines.append('msa_stage_seconds{{stage="{}"}} {}'.format(name,
+                                                                 seconds))
+    for name, value in values['counters'].items():
+        lines.append('# TYPE msa_{}_total counter'.format(name))
+        lines.append('msa_{}_total {}'.format(name, value))
+        lines.append('# TYPE msa_{}_per_second gauge'.format(name))
+        lines.append('msa_{}_per_second {}'.format(
+            name, values['rates'][name]))
+    for name, value in values['peaks'].items():
+        lines.append('# TYPE msa_{}_max gauge'.format(name))
+        lines.append('msa_{}_max {}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def close():
+    """
+    Write the summary and stop recording metrics.
+    :return: nothing
+    """
+    global enabled, _file
+    if _file is None:
+        return
+
+    values = summary()
+    if _format == 'jsonl':
+        _write_line({'type': 'summary', **values})
+    else:
+        _file.write(_prometheus(values))
+    _file.close()
+    _file = None
+    enabled = False
@@ -0,0 +1,50 @@
+"""
+Bit-parallel unit-cost edit distance (Myers 1999, global form by Hyyro).
+
+A whole column of the edit distance matrix is encoded as two bit vectors of
+vertical +1/-1 differences, held in Python integers, so each character of the
+text advances the column with a handful of word operations.
+"""
+
+
+def edit_distance(v, w):
+    """
+    Compute the unit-cost edit distance of v and w.
+    :param v: first string
+    :param w: other string
+    :return: the minimum number of insertions, deletions and substitutions
+    turning v into w
+    """
+    m = len(v)
+    if m == 0:
+        return len(w)
+
+    # Bit i of peq[c] is set when v[i] == c
+    peq = {}
+    for i, c in enumerate(v):
+        peq[c] = peq.get(c, 0) | (1 << i)
+
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv = full
+    mv = 0
+    score = m
+    for c in w:
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+
+        # The top row of the matrix increases by one per character of w
+        ph = (ph << 1) | 1
+        mh <<= 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+
+    return score
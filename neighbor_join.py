@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class Node:
     def __init__(self, label):
         self.label = label
@@ -16,25 +19,11 @@ class Node:
         return hash(self.label)
 
 
-def score(c1, c2, distances, clusters):
-    """
-    Compute the neighbor joining distance score between two clusters
-    :param c1: the first cluster
-    :param c2: the other cluster
-    :param distances: the distance matrix
-    :param clusters: the list of clusters
-    :return: the score of (c1, c2)
-    """
-    u1 = sum(distances[c1, ck] for ck in clusters if ck != c1)
-    u2 = sum(distances[c2, ck] for ck in clusters if ck != c2)
-
-    return (len(clusters)-2)*distances[c1, c2] - u1 - u2
-
-
-def write_dot(root):
+def write_dot(root, path='out.dot'):
     """
     Write a graph to a dot file.
     :param root: the root of the tree
+    :param path: the file to write
     :return: nothing
     """
 
@@ -50,39 +39,200 @@ def write_dot(root):
 
     out = 'digraph mygraph {\n' + nodes + edges + '\n}'
 
-    with open('out.dot', 'w') as f:
+    with open(path, 'w') as f:
         f.write(out)
 
 
-def construct_tree(D, sequences):
+# Characters that must be quoted in a Newick label
+_NEWICK_SPECIAL = set("()[]':;, \t\n")
+
+
+def _newick_label(label):
+    if any(c in _NEWICK_SPECIAL for c in label):
+        return "'" + label.replace("'", "''") + "'"
+    return label
+
+
+def to_newick(root):
     """
-    Create a guide tree using neighbor joining.
-    :param D: the distance matrix
-    :param sequences: the dictionary of sequences
-    :return: the root of the constructed tree
+    Write a tree in Newick format. Only the leaves are named; an internal
+    node is named after its leaves when the tree is read back.
+    :param root: the root of the tree
+    :return: the Newick string, ending with ';'
     """
+    parts = []
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif item.children:
+            stack.append(')')
+            for k, child in enumerate(reversed(item.children)):
+                stack.append(child)
+                if k < len(item.children) - 1:
+                    stack.append(',')
+            stack.append('(')
+        else:
+            parts.append(_newick_label(item.label))
+
+    return ''.join(parts) + ';'
+
+
+def _join(children):
+    """
+    Join nodes under a new binary node; more than two children are joined
+    two at a time from the left.
+    """
+    node = children[0]
+    for child in children[1:]:
+        parent = Node(node.label + ',' + child.label)
+        parent.add(node, child)
+        node = parent
+    return node
 
-    clusters = [Node(name) for name in sequences]
-    distances = {(c1, c2): D[c1.label, c2.label] for c1 in clusters
-                                               for c2 in clusters}
-
-    while len(clusters) > 1:
-        cx, cy = min(((c1, c2) for c1 in clusters for c2 in clusters if c1 != c2),
-                     key=lambda x: score(x[0], x[1], distances, clusters))
-        new_cluster = Node(cx.label + ',' + cy.label)
-        new_cluster.add(cx, cy)
 
-        clusters.remove(cx)
-        clusters.remove(cy)
+def from_newick(text):
+    """
+    Read a tree in Newick format. Branch lengths and internal node names are
+    ignored; internal nodes are labelled with the labels of their children
+    joined by commas, as construct_tree() labels them. Nodes with more than
+    two children, such as the root of an unrooted tree, are resolved into
+    binary nodes.
+    :param text: the Newick string
+    :return: the root of the tree
+    :raises ValueError: if the string is not a well formed tree
+    """
+    stack = [[]]
+    k = 0
+    n = len(text)
+    while k < n:
+        c = text[k]
+        if c == '(':
+            stack.append([])
+            k += 1
+        elif c == ')':
+            if len(stack) < 2:
+                raise ValueError('unbalanced parentheses in Newick tree')
+            children = stack.pop()
+            if not children:
+                raise ValueError('empty node in Newick tree')
+            stack[-1].append(_join(children))
+            k += 1
+            # Skip the name of the internal node
+            if k < n and text[k] == "'":
+                while k < n and text[k] == "'":
+                    k = text.index("'", k + 1) + 1
+            while k < n and text[k] not in ',();:[':
+                k += 1
+        elif c == ':':
+            k += 1
+            while k < n and text[k] not in ',();[':
+                k += 1
+        elif c == '[':
+            k = text.index(']', k) + 1
+        elif c in ', \t\r\n':
+            k += 1
+        elif c == ';':
+            break
+        elif c == "'":
+            label = []
+            k += 1
+            while True:
+                end = text.index("'", k)
+                label.append(text[k:end])
+                if end + 1 < n and text[end + 1] == "'":
+                    label.append("'")
+                    k = end + 2
+                else:
+                    k = end + 1
+                    break
+            stack[-1].append(Node(''.join(label)))
+        else:
+            start = k
+            while k < n and text[k] not in ',();:[':
+                k += 1
+            stack[-1].append(Node(text[start:k].strip()))
+
+    if len(stack) != 1 or len(stack[0]) != 1:
+        raise ValueError('malformed Newick tree')
+    return stack[0][0]
+
+
+def write_newick(root, path):
+    """
+    Write a tree to a Newick file.
+    :param root: the root of the tree
+    :param path: the file to write
+    :return: nothing
+    """
+    with open(path, 'w') as f:
+        f.write(to_newick(root) + '\n')
 
-        for cz in clusters:
-            new_distance = (distances[cx, cz] + distances[cy, cz]
-                            - distances[cx, cy]) / 2
-            distances[new_cluster, cz] = new_distance
-            distances[cz, new_cluster] = new_distance
 
-        clusters.append(new_cluster)
+def read_newick(path):
+    """
+    Read a tree from a Newick file.
+    :param path: the file to read
+    :return: the root of the tree
+    """
+    with open(path) as f:
+        return from_newick(f.read())
 
-    write_dot(clusters[0])
 
-    return clusters[0]
\ No newline at end of file
+def construct_tree(D, sequences, dot_path='out.dot'):
+    """
+    Create a guide tree using neighbor joining.
+    :param D: the distance matrix
+    :param sequences: the dictionary of sequences
+    :param dot_path: where to write the tree as a dot file, None to skip it
+    :return: the root of the constructed tree
+    """
+    names = list(sequences)
+    n = len(names)
+    if hasattr(D, 'index'):
+        rows = [D.index[name] for name in names]
+        distances = np.array(D.matrix, dtype=float)[np.ix_(rows, rows)]
+    else:
+        distances = np.array([[D[a, b] for b in names] for a in names],
+                             dtype=float)
+
+    # Clusters are rows of the distance matrix; a joined cluster takes over
+    # the row of its first child. order lists the active rows in the order
+    # the clusters were created, which decides ties between equal scores.
+    clusters = [Node(name) for name in names]
+    order = list(range(n))
+    np.fill_diagonal(distances, 0)
+
+    while len(order) > 1:
+        active = np.array(order)
+        r = len(active)
+        block = distances[np.ix_(active, active)]
+
+        # Row sums are accumulated left to right, in cluster order, so that
+        # the scores round exactly as a sequential sum would
+        totals = np.cumsum(block, axis=1)[:, -1]
+        scores = (r - 2) * block - totals[:, None] - totals[None, :]
+        np.fill_diagonal(scores, np.inf)
+        p, q = divmod(int(scores.argmin()), r)
+        x, y = active[p], active[q]
+
+        new_cluster = Node(clusters[x].label + ',' + clusters[y].label)
+        new_cluster.add(clusters[x], clusters[y])
+
+        order.remove(x)
+        order.remove(y)
+        rest = np.array(order, dtype=int)
+
+        new_distances = (distances[x, rest] + distances[y, rest]
+                         - distances[x, y]) / 2
+        distances[x, rest] = new_distances
+        distances[rest, x] = new_distances
+        clusters[x] = new_cluster
+        order.append(x)
+
+    root = clusters[order[0]]
+    if dot_path is not None:
+        write_dot(root, dot_path)
+
+    return root
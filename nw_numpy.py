@@ -0,0 +1,355 @@
+"""
+Needleman-Wunsch engine over NumPy arrays.
+
+The recurrence is filled one row at a time. Deletions and substitutions only
+depend on the previous row, so they are computed for the whole row at once;
+insertions along the row are resolved with a running maximum over the
+cumulative gap scores (the prefix-max trick). Back pointers are stored in a
+uint8 matrix and tie-breaking matches the list-of-lists implementations:
+an insertion is only taken when strictly better than both alternatives, and a
+deletion only when strictly better than a substitution.
+"""
+
+import numpy as np
+
+from encoding import GAP, encode
+import matrices
+import metrics
+
+INSERT = 0
+DELETE = 1
+SUBSTITUTE = 2
+START = 3
+
+# Initial band width for band='auto'
+AUTO_BAND = 16
+
+
+def fill(v_codes, table, gap_v, gap_w, insert=True, pointers=True,
+         band=None, last_row=False, first_row=None):
+    """
+    Fill the Needleman-Wunsch matrix row by row.
+    :param v_codes: row indices into table, one per character of v
+    :param table: array whose row table[v_codes[i]] holds the substitution
+    scores of v[i] against every character of w
+    :param gap_v: gap_v[i] is the score of aligning v[i] to a gap
+    :param gap_w: gap_w[j] is the score of aligning w[j] to a gap
+    :param insert: whether gaps may be inserted into v
+    :param pointers: whether to record back pointers
+    :param band: None to fill the whole matrix, or a tuple (lo, hi) to only
+    fill the cells with lo <= j - i <= hi
+    :param last_row: whether to return the whole last row instead of the
+    score of the bottom-right cell
+    :param first_row: the scores of row 0, to continue a matrix filled
+    earlier; by default row 0 holds the scores of gaps in v. Not supported
+    with a band
+    :return: a tuple (score, back_pointers), back_pointers being None if not
+    recorded; with a band, back_pointers[i, j - i - lo] is the pointer of cell
+    (i, j)
+    """
+    m = len(v_codes)
+    n = len(gap_w)
+    lo, hi = band if band is not None else (-m, n)
+
+    # Row 0 and the running offsets used by the prefix-max trick
+    dtype = np.result_type(gap_v, gap_w)
+    offsets = np.zeros(n + 1, dtype=dtype)
+    np.cumsum(gap_w, out=offsets[1:])
+    if first_row is None:
+        previous = offsets.copy()
+    else:
+        previous = np.array(first_row, dtype=dtype)
+    previous[hi + 1:] = _lowest(dtype)
+    current = np.empty_like(previous)
+
+    back = None
+    if pointers:
+        if band is None:
+            back = np.empty((m + 1, n + 1), dtype=np.uint8)
+        else:
+            back = np.full((m + 1, hi - lo + 1), START, dtype=np.uint8)
+        shift = 0 if band is None else lo
+        back[0, -shift:min(n, hi) + 1 - shift] = INSERT
+        back[0, -shift] = START
+
+    if metrics.enabled:
+        metrics.count('dp_cells', m * n if band is None
+                      else (m + 1) * (hi - lo + 1))
+        if back is not None:
+            metrics.peak('dp_matrix_bytes', back.nbytes)
+
+    for i in range(1, m + 1):
+        # Columns of this row inside the band; start is the first one with a
+        # diagonal predecessor
+        low = max(0, i + lo)
+        high = min(n, i + hi)
+        start = max(low, 1)
+        shift = 0 if band is None else i + lo
+
+        delete = previous[start:high + 1] + gap_v[i - 1]
+        substitute = (previous[start - 1:high]
+                      + table[v_codes[i - 1]][start - 1:high])
+        if low == 0:
+            current[0] = previous[0] + gap_v[i - 1]
+        np.maximum(delete, substitute, out=current[start:high + 1])
+
+        if pointers:
+            if low == 0:
+                back[i, -shift] = DELETE
+            row = back[i, start - shift:high + 1 - shift]
+            row[:] = SUBSTITUTE
+            row[delete > substitute] = DELETE
+
+        if insert and high > low:
+            cells = current[low:high + 1]
+            best = cells[start - low:].copy() if pointers else None
+            cells -= offsets[low:high + 1]
+            np.maximum.accumulate(cells, out=cells)
+            cells += offsets[low:high + 1]
+            if pointers:
+                row[cells[start - low:] > best] = INSERT
+
+        if high < n:
+            current[high + 1] = _lowest(dtype)
+        previous, current = current, previous
+
+    return (previous.copy() if last_row else previous[n]), back
+
+
+def _lowest(dtype):
+    """
+    The score of cells outside the band, low enough to never be chosen.
+    """
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).min // 4
+    return -np.inf
+
+
+def traceback(back, v, w, band=None):
+    """
+    Follow back pointers from the bottom-right cell to build the alignment.
+    :param back: the back pointer matrix filled by fill()
+    :param v: first aligned string
+    :param w: other aligned string
+    :param band: the band passed to fill()
+    :return: a tuple (v_aligned, w_aligned) of aligned strings
+    """
+    return path_strings(trace_path(back, len(v), len(w), band)[0], v, w)
+
+
+def trace_path(back, m, n, band=None):
+    """
+    Follow back pointers from the bottom-right cell to the top-left one.
+    :return: a tuple (path, low, high) with the back pointers along the path
+    in reverse order and the lowest and highest diagonal j - i it visits
+    """
+    lo = 0 if band is None else band[0]
+    banded = band is not None
+    i, j = m, n
+    low = high = n - m
+    path = []
+    back_pointer = back[i, j - (i + lo if banded else 0)]
+    while back_pointer != START:
+        path.append(back_pointer)
+        if back_pointer != DELETE:
+            j -= 1
+        if back_pointer != INSERT:
+            i -= 1
+        low = min(low, j - i)
+        high = max(high, j - i)
+        back_pointer = back[i, j - (i + lo if banded else 0)]
+
+    return path, low, high
+
+
+def path_strings(path, v, w):
+    """
+    Build the aligned strings from a reversed path of back pointers.
+    """
+    i, j = len(v), len(w)
+    v_aligned = []
+    w_aligned = []
+    for back_pointer in path:
+        if back_pointer == INSERT:
+            j -= 1
+            v_aligned.append('-')
+            w_aligned.append(w[j])
+        elif back_pointer == DELETE:
+            i -= 1
+            v_aligned.append(v[i])
+            w_aligned.append('-')
+        else:
+            i -= 1
+            j -= 1
+            v_aligned.append(v[i])
+            w_aligned.append(w[j])
+
+    return ''.join(reversed(v_aligned)), ''.join(reversed(w_aligned))
+
+
+def banded_align(v_codes, table, gap_v, gap_w, width):
+    """
+    Align within a band around the diagonal, doubling its width until the
+    optimal path stays clear of the edge of the band and every path leaving
+    the band scores strictly less. A path leaving the band that ties the
+    optimum could be the one the full matrix traces back, so ties widen the
+    band as well, and the alignment is the same as without a band.
+    :param v_codes: row indices into table, one per character of v
+    :param table: substitution score table, as for fill()
+    :param gap_v: gap_v[i] is the score of aligning v[i] to a gap
+    :param gap_w: gap_w[j] is the score of aligning w[j] to a gap
+    :param width: the initial number of diagonals on each side of the band
+    :return: a tuple (score, path) with the optimal score and the reversed
+    path of back pointers
+    """
+    m = len(v_codes)
+    n = len(gap_w)
+    width = max(width, 1)
+    while True:
+        band = (min(0, n - m) - width, max(0, n - m) + width)
+        score, back = fill(v_codes, table, gap_v, gap_w, band=band)
+        path, low, high = trace_path(back, m, n, band)
+        lower = band[0] <= -m
+        upper = band[1] >= n
+        if lower and upper:
+            return score, path
+        if ((lower or low > band[0]) and (upper or high < band[1])
+                and score > _outside_bound(v_codes, table, gap_v, gap_w,
+                                            band)):
+            return score, path
+        width *= 2
+
+
+def _outside_bound(v_codes, table, gap_v, gap_w, band):
+    """
+    Upper bound on the score of any path that leaves the band. Such a path
+    needs a minimum number of deletions, and every deletion costs a
+    substitution; the bound takes the best substitution each character of v
+    could get together with the best gap scores.
+    """
+    m = len(v_codes)
+    n = len(gap_w)
+    lo, hi = band
+
+    # Fewest deletions of a path reaching diagonal lo - 1 or hi + 1
+    fewest = m
+    if lo > -m:
+        fewest = min(fewest, max(0, 1 - lo) + max(0, lo - 1 - (n - m)))
+    if hi < n:
+        fewest = min(fewest, max(0, -hi - 1) + max(0, hi + 1 - (n - m)))
+
+    def best_sums(values):
+        sums = np.zeros(len(values) + 1)
+        np.cumsum(np.sort(values)[::-1], out=sums[1:])
+        return sums
+
+    substitutions = best_sums(table[v_codes].max(axis=1) if n > 0
+                              else np.zeros(m))
+    deletions = best_sums(gap_v)
+    insertions = best_sums(gap_w)
+    counts = np.arange(fewest, m + 1)
+    counts = counts[(counts + n - m >= 0) & (counts + n - m <= n)]
+    if len(counts) == 0:
+        return _lowest(np.float64)
+    return (substitutions[m - counts] + deletions[counts]
+            + insertions[counts + n - m]).max()
+
+
+def band_width(band, v, w):
+    """
+    Resolve the band option of the aligners to an initial band width.
+    :param band: 'auto' or the number of diagonals on each side of the band
+    :param v: first string to align
+    :param w: other string to align
+    :return: the initial band width
+    """
+    if band == 'auto':
+        return max(AUTO_BAND, (len(v) + len(w)) // 100)
+    return band
+
+
+def edit_table(v, w, match, mismatch, indel, gap_matches=False):
+    """
+    Build score arrays for aligning v and w under a match/mismatch/indel cost
+    scheme. Costs are negated so that fill() can maximize.
+    :param gap_matches: whether '-' matches any character
+    :return: a tuple (v_codes, table, gap_v, gap_w)
+    """
+    alphabet, codes = np.unique(
+        np.frombuffer((v + w).encode('latin-1'), dtype=np.uint8),
+        return_inverse=True)
+    same = alphabet[:, None] == alphabet[None, :]
+    if gap_matches:
+        gap = alphabet == ord('-')
+        same |= gap[:, None] | gap[None, :]
+    table = -np.where(same, match, mismatch).astype(np.int64)
+    v_codes = codes[:len(v)]
+    w_codes = codes[len(v):]
+    return (v_codes, table[:, w_codes], np.full(len(v), -indel, np.int64),
+            np.full(len(w), -indel, np.int64))
+
+
+def _matrix_tables(v, w, matrix):
+    v_codes = encode(v)
+    w_codes = encode(w)
+    table = matrices.scoring_matrix(matrix)
+    return v_codes, table[:, w_codes], table[v_codes, GAP], \
+        table[GAP, w_codes]
+
+
+def _matrix_fill(v, w, matrix, insert=True, pointers=True):
+    return fill(*_matrix_tables(v, w, matrix), insert=insert,
+                pointers=pointers)
+
+
+def align_score(v, w, matrix=matrices.DEFAULT):
+    """
+    Finds the optimal alignment score of v and w.
+    :param v: first string to align
+    :param w: other string to align
+    :param matrix: the name of the scoring matrix
+    :return: the score of the alignment
+    """
+    return int(_matrix_fill(v, w, matrix, pointers=False)[0])
+
+
+def align_path(v, w, band=None, matrix=matrices.DEFAULT):
+    """
+    Finds an optimal global alignment of v and w as a path of back pointers.
+    :param v: first string to align
+    :param w: other string to align
+    :param band: None to fill the whole matrix, or 'auto' or an initial band
+    width to only fill cells near the diagonal
+    :param matrix: the name of the scoring matrix
+    :return: the back pointers along the path, in reverse order, as taken by
+    path_strings()
+    """
+    if band is None:
+        return trace_path(_matrix_fill(v, w, matrix)[1], len(v), len(w))[0]
+    return banded_align(*_matrix_tables(v, w, matrix),
+                        band_width(band, v, w))[1]
+
+
+def sequence_align(v, w, band=None, matrix=matrices.DEFAULT):
+    """
+    Finds an optimal global alignment of v and w.
+    :param v: first string to align
+    :param w: other string to align
+    :param band: None to fill the whole matrix, or 'auto' or an initial band
+    width to only fill cells near the diagonal
+    :param matrix: the name of the scoring matrix
+    :return: a tuple (v_aligned, w_aligned) of aligned strings
+    """
+    return path_strings(align_path(v, w, band, matrix), v, w)
+
+
+def gap_align(center, w, matrix=matrices.DEFAULT):
+    """
+    Aligns w to the center string without inserting gaps into the center.
+    :param center: the center string
+    :param w: the string to align
+    :param matrix: the name of the scoring matrix
+    :return: w with gaps added so that it aligns to center
+    """
+    return traceback(_matrix_fill(center, w, matrix, insert=False)[1],
+                     center, w)[1]
@@ -0,0 +1,201 @@
+"""
+Progressive alignment with the independent subtrees of the guide tree
+aligned concurrently in worker processes.
+
+A node is aligned as soon as both of its children are. Profiles travel
+between processes in a compact packed form: the names of their sequences,
+the alignment column of every residue and the number of columns. Workers
+hold the sequences themselves and rebuild the column counts on arrival.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import time
+
+import numpy as np
+
+import matrices
+import metrics
+from profile import MAX_CELLS, Profile, profile_align
+
+# Sequences and scoring matrix of a worker process
+_sequences = None
+_matrix = None
+
+
+def _init_worker(sequences, matrix, record=False):
+    global _sequences, _matrix
+    _sequences = sequences
+    _matrix = matrix
+    metrics.start_worker(record)
+
+
+def pack(names, profile):
+    """
+    Pack a profile to send it to another process.
+    :param names: the names of the sequences of the profile, in order
+    :param profile: the profile to pack
+    :return: a tuple (names, columns, length)
+    """
+    columns = profile.columns.astype(np.min_scalar_type(profile.length))
+    return tuple(names), columns, profile.length
+
+
+def unpack(packed, sequences):
+    """
+    Rebuild a packed profile.
+    :param packed: the tuple returned by pack()
+    :param sequences: the dictionary of sequences
+    :return: the Profile
+    """
+    names, columns, length = packed
+    return Profile([sequences[name] for name in names],
+                   columns.astype(np.intp), length)
+
+
+def _leaf(name, sequences):
+    sequence = sequences[name]
+    return (name,), np.arange(len(sequence),
+                              dtype=np.min_scalar_type(len(sequence))), \
+        len(sequence)
+
+
+def _merge(packed1, packed2, sequences=None, matrix=None):
+    """
+    Align two packed profiles.
+    :return: a tuple (packed, seconds) with the packed combined profile and
+    the time the alignment took
+    """
+    sequences = _sequences if sequences is None else sequences
+    matrix = _matrix if matrix is None else matrix
+    start = time.perf_counter()
+    combined = profile_align(unpack(packed1, sequences),
+                             unpack(packed2, sequences), MAX_CELLS, matrix)
+    seconds = time.perf_counter() - start
+    return pack(packed1[0] + packed2[0], combined), seconds
+
+
+def _merge_task(packed1, packed2):
+    """
+    Align two packed profiles in a worker process.
+    :return: a tuple (packed, seconds, recorded) with the result of _merge()
+    and the metrics recorded meanwhile
+    """
+    return _merge(packed1, packed2) + (metrics.take(),)
+
+
+def _record(node, packed):
+    """
+    Record the metrics of a node aligned in a worker process, which cannot
+    record them itself.
+    """
+    left, right = (packed[child] for child in node.children)
+    metrics.event('profile_align', sequences1=len(left[0]), columns1=left[2],
+                  sequences2=len(right[0]), columns2=right[2],
+                  columns=packed[node][2])
+
+
+def _postorder(root):
+    """
+    List the nodes of a tree with every node after its children.
+    """
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children)
+    nodes.reverse()
+    return nodes
+
+
+def _restore(root, sequences, saved):
+    """
+    Find the profiles the alignment starts from: the saved profiles of the
+    highest nodes that have one, and the leaves that are not below them.
+    """
+    packed = {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.label in saved:
+            packed[node] = saved[node.label]
+        elif not node.children:
+            packed[node] = _leaf(node.label, sequences)
+        else:
+            stack.extend(node.children)
+    return packed
+
+
+def parallel_align(root, sequences, workers=None, matrix=matrices.DEFAULT,
+                   saved=None, on_done=None):
+    """
+    Perform progressive alignment along the guide tree, aligning independent
+    subtrees at the same time. The result is the same as aligning the tree
+    serially.
+    :param root: the root node of the guide tree
+    :param sequences: the dictionary of sequences to align
+    :param workers: the number of worker processes, None for one per CPU;
+    with 1 the tree is aligned in this process
+    :param matrix: the name of the scoring matrix
+    :param saved: a dictionary node label -> packed profile of nodes aligned
+    by an earlier run, which are not aligned again
+    :param on_done: a function called with each node and its packed profile
+    as soon as the node is aligned, e.g. to save it
+    :return: a tuple (profile, timings) with the Profile of the alignment and
+    a list of (node, seconds) pairs, one per internal node, in the order the
+    alignments finished
+    """
+    nodes = _postorder(root)
+    parent = {child: node for node in nodes for child in node.children}
+    packed = _restore(root, sequences, saved or {})
+    timings = []
+
+    def pending(node):
+        return node.children and node not in packed \
+            and all(child in packed for child in node.children)
+
+    if workers == 1 or len(nodes) < 5:
+        for node in nodes:
+            if pending(node):
+                left, right = node.children
+                packed[node], seconds = _merge(packed[left], packed[right],
+                                               sequences, matrix)
+                timings.append((node, seconds))
+                if on_done is not None:
+                    on_done(node, packed[node])
+        return unpack(packed[root], sequences), timings
+
+    def ready(node):
+        return node in parent and all(sibling in packed for sibling
+                                      in parent[node].children)
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker,
+                             initargs=(sequences, matrix,
+                                       metrics.enabled)) as executor:
+        running = {}
+
+        def submit(node):
+            left, right = node.children
+            running[executor.submit(_merge_task, packed[left],
+                                    packed[right])] = node
+
+        for node in nodes:
+            if pending(node):
+                submit(node)
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                packed[node], seconds, recorded = future.result()
+                timings.append((node, seconds))
+                metrics.merge(recorded)
+                _record(node, packed)
+                if on_done is not None:
+                    on_done(node, packed[node])
+                for child in node.children:
+                    del packed[child]
+                if ready(node):
+                    submit(parent[node])
+
+    return unpack(packed[root], sequences), timings
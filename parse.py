@@ -1,5 +1,169 @@
+import mmap
+import os
 from re import search
 
+# Bytes removed from sequence lines
+_WHITESPACE = b' \t\r\n'
+
+
+def record_name(header):
+    """
+    Name a record by its header: the species in square brackets if there is
+    one, otherwise the first word of the header.
+    :param header: the header line, without the leading '>'
+    :return: the name of the record
+    """
+    species = search(r'\[(.*)\]', header)
+    if species is not None:
+        return species.group(1)
+    words = header.split()
+    return words[0] if words else ''
+
+
+def _name(header):
+    """
+    Name a record the way the pipelines do: by record_name() of its upper
+    case header.
+    :param header: the header line as bytes, without the leading '>'
+    :return: the name of the record
+    """
+    return record_name(header.decode('latin-1').upper())
+
+
+def _records(data):
+    """
+    Find the records of a FASTA file.
+    :param data: the contents of the file, e.g. a memory map
+    :return: a generator of (header_start, sequence_start, end) byte offsets
+    """
+    start = data.find(b'>')
+    while start != -1:
+        header_end = data.find(b'\n', start)
+        if header_end == -1:
+            header_end = len(data)
+        end = data.find(b'\n>', header_end)
+        end = len(data) if end == -1 else end + 1
+        yield start, min(header_end + 1, len(data)), end
+        start = end if end < len(data) else -1
+
+
+def read_fasta(path):
+    """
+    Read the records of a FASTA file one at a time, without loading the whole
+    file in memory.
+    :param path: the path to the file
+    :return: a generator of (header, sequence) pairs of bytes, the header
+    without the leading '>'
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start, sequence_start, end in _records(data):
+                header = data[start + 1:sequence_start].rstrip(b'\r\n')
+                yield header, data[sequence_start:end].translate(None,
+                                                                 _WHITESPACE)
+
+
+def build_index(path, index_path=None):
+    """
+    Write a .fai style index of a FASTA file: one line per record with its
+    name, sequence length, offset of the sequence, residues per line and
+    bytes per line, separated by tabs. Records are named as parse_fasta()
+    names them.
+    :param path: the path to the FASTA file
+    :param index_path: where to write the index, by default path + '.fai'
+    :return: the path of the index
+    """
+    if index_path is None:
+        index_path = path + '.fai'
+
+    entries = []
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+            if size > 0 else b''
+        try:
+            for start, sequence_start, end in _records(data):
+                header = data[start + 1:sequence_start].rstrip(b'\r\n')
+                lines = data[sequence_start:end].splitlines(keepends=True)
+                # Blank lines before the next record are not part of the
+                # sequence
+                while lines and not lines[-1].strip():
+                    lines.pop()
+                widths = [len(line) for line in lines]
+                bases = [len(line.rstrip(b'\r\n')) for line in lines]
+                if len(set(widths[:-1])) > 1 or len(set(bases[:-1])) > 1 \
+                        or (len(lines) > 1 and bases[-1] > bases[0]):
+                    raise ValueError('uneven line lengths in record {}'
+                                     .format(header.decode('latin-1')))
+                entries.append((_name(header),
+                                sum(bases), sequence_start,
+                                bases[0] if lines else 0,
+                                widths[0] if lines else 0))
+        finally:
+            if size > 0:
+                data.close()
+
+    with open(index_path, 'w') as f:
+        for entry in entries:
+            f.write('\t'.join(str(field) for field in entry) + '\n')
+
+    return index_path
+
+
+class FastaIndex:
+    """
+    Random access to the sequences of a FASTA file by name, through a .fai
+    style index that is built if it does not exist yet.
+    """
+
+    def __init__(self, path, index_path=None):
+        if index_path is None:
+            index_path = path + '.fai'
+        if not os.path.exists(index_path):
+            build_index(path, index_path)
+
+        self.entries = {}
+        with open(index_path) as f:
+            for line in f:
+                name, length, offset, bases, width = line.rstrip('\n') \
+                    .split('\t')
+                self.entries[name] = (int(length), int(offset), int(bases),
+                                      int(width))
+
+        self._file = open(path, 'rb')
+        self._data = mmap.mmap(self._file.fileno(), 0,
+                               access=mmap.ACCESS_READ) if self.entries \
+            else b''
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __getitem__(self, name):
+        """
+        Read one sequence.
+        :param name: the name of the record
+        :return: the sequence as bytes
+        """
+        length, offset, bases, width = self.entries[name]
+        if length == 0:
+            return b''
+        lines, rest = divmod(length, bases)
+        end = offset + lines * width + rest
+        return self._data[offset:end].translate(None, _WHITESPACE)
+
+    def close(self):
+        if self.entries:
+            self._data.close()
+        self._file.close()
+
 
 def parse_fasta(path):
     """
@@ -7,28 +171,10 @@ def parse_fasta(path):
     :param path: the path to the file
     :return: a dictionary with species name -> sequence
     """
-    try:
-        with open(path) as f:
-            lines = [line.strip().upper() for line in f.readlines()]
-    except FileNotFoundError:
-        print('Error: no such file: {}'.format(path))
-        exit(1)
-
     sequences = {}
-    current = ''
-    name = ''
-    for line in lines:
-        if line.startswith('>'):
-            if len(current) > 0:
-                sequences[name] = current
-            current = ''
-            name = search('\[(.*)\]', line).group(1)
-            continue
-
-        current += line
-
-    if len(current) > 0:
-        sequences[name] = current
+    for header, sequence in read_fasta(path):
+        if len(sequence) > 0:
+            name = _name(header)
+            sequences[name] = sequence.decode('latin-1').upper()
 
     return sequences
-
@@ -1,132 +1,248 @@
-START = -1
-INSERT = 0
-DELETE = 1
-SUBSTITUTE = 2
+import numpy as np
 
+from encoding import CODES, GAP, PROTEINS, encode
+import matrices
+import metrics
+import nw_numpy
 
-# Load in BLOSUM62 matrix
-with open('blosum62.txt') as f:
-    blosum_file = f.readlines()
-
-proteins = blosum_file[0].split()
+INSERT = 0
+DELETE = 1
 
-blosum = {}
-for line in blosum_file[1:]:
-    line = line.split()
-    for index, entry in enumerate(line[1:]):
-        blosum[line[0], proteins[index]] = int(entry)
+# Alignments with more matrix cells than this are traced back in blocks
+MAX_CELLS = 1000000
 
 
 class Profile:
-    def __init__(self, sequences, alignments):
-        n = len(alignments)
-        self.length = len(alignments[0])
-
+    """
+    A multiple alignment stored as the original sequences and the alignment
+    column of every residue; the aligned strings are only built on request.
+    """
+    __slots__ = ('sequences', 'codes', 'columns', 'length', 'counts',
+                 'frequency')
+
+    def __init__(self, sequences, columns, length, counts=None):
+        """
+        :param sequences: the list of unaligned sequences
+        :param columns: an int array with the alignment column of every
+        residue, for all the sequences one after the other
+        :param length: the number of alignment columns
+        :param counts: the column counts, computed from the residues if
+        not given
+        """
         self.sequences = sequences
-        self.alignments = alignments
-        self.frequency = {(protein, i): 0 for protein in proteins
-                          for i in range(len(self))}
-
-        for alignment in alignments:
-            for index, protein in enumerate(alignment):
-                self.frequency[protein, index] += 1 / n
+        self.codes = np.concatenate([encode(sequence)
+                                     for sequence in sequences])
+        self.columns = columns
+        self.length = length
+
+        # counts[i, x] is the number of alignments with protein x in column i
+        if counts is None:
+            counts = np.bincount(
+                columns * len(PROTEINS) + self.codes,
+                minlength=len(PROTEINS) * length
+            ).reshape(length, len(PROTEINS)).astype(np.uint32)
+            counts[:, GAP] += len(sequences) - counts.sum(axis=1,
+                                                          dtype=np.uint32)
+        self.counts = counts
+        self.frequency = self.counts / len(sequences)
 
     def __len__(self):
         return self.length
 
     def __getitem__(self, item):
-        return self.frequency[item]
+        protein, i = item
+        return self.frequency[i, CODES[protein]]
+
+    @property
+    def alignments(self):
+        """
+        Build the aligned strings.
+        :return: the list of aligned sequences, gaps written as '-'
+        """
+        rows = np.full((len(self.sequences), self.length), ord('-'),
+                       dtype=np.uint8)
+        lengths = [len(sequence) for sequence in self.sequences]
+        row_of = np.repeat(np.arange(len(self.sequences)), lengths)
+        rows[row_of, self.columns] = np.frombuffer(
+            ''.join(self.sequences).encode('latin-1'), dtype=np.uint8)
+        return [row.tobytes().decode('latin-1') for row in rows]
+
+
+def sequence_profile(sequence):
+    """
+    Create the profile of a single sequence.
+    :param sequence: the sequence
+    :return: a Profile with one column per residue
+    """
+    return Profile([sequence], np.arange(len(sequence)), len(sequence))
+
+
+def alignment_profile(alignments):
+    """
+    Create the profile of an existing alignment.
+    :param alignments: the list of aligned sequences, gaps written as '-'
+    :return: a Profile of the alignment
+    """
+    length = len(alignments[0])
+    rows = np.frombuffer(''.join(alignments).encode('latin-1'),
+                         dtype=np.uint8).reshape(len(alignments), length)
+    residues = rows != ord('-')
+    sequences = [alignment.replace('-', '') for alignment in alignments]
+    return Profile(sequences, np.nonzero(residues)[1], length)
 
 
-def psp_empty(p, i):
+def psp_empty(p, i, matrix=matrices.DEFAULT):
     """
     Calculate the PSP score of a profile column with an empty column
     :param p: the profile whose score to compute
     :param i: the index of the column
+    :param matrix: the name of the scoring matrix
     :return: the PSP score
     """
-    return sum(p[x, i] * blosum[x, '-'] for x in proteins)
+    return p.frequency[i] @ matrices.gap_scores(matrix)
 
 
-def psp(p1, p2, i, j):
+def psp(p1, p2, i, j, matrix=matrices.DEFAULT):
     """
     Calculate the PSP score between two profile columns
     :param p1: the first profile
     :param p2: the other profile
     :param i: the index of the p1 column
     :param j: the index of the p2 column
+    :param matrix: the name of the scoring matrix
     :return: the PSP score
     """
-    return sum(p1[x, i]*p2[y, j]*blosum[x, y]
-               for x in proteins for y in proteins)
+    return (p1.frequency[i] @ matrices.scoring_matrix(matrix)
+            @ p2.frequency[j])
 
 
-def profile_align(p1, p2):
+def _scaled_gaps(p1, p2, table):
+    """
+    Compute the scaled PSP scores of the columns of two profiles against
+    empty columns. Alignments score profiles on counts instead of
+    frequencies: every PSP score is scaled by the product of the two profile
+    sizes, which keeps the dynamic programming in exact integers and makes
+    ties break consistently.
+    :return: a tuple (gaps1, gaps2) of int64 arrays, one entry per column
+    """
+    n1 = len(p1.sequences)
+    n2 = len(p2.sequences)
+    return (n2 * (p1.counts @ table[:, GAP]),
+            n1 * (p2.counts @ table[:, GAP]))
+
+
+class _ScoreRows:
+    """
+    Rows of the scaled PSP score matrix of two profiles, computed on demand
+    so that linear-memory passes never hold the whole matrix.
+    """
+
+    def __init__(self, counts1, counts2, table):
+        self.left = counts1 @ table
+        self.right = counts2.T.astype(np.int64)
+
+    def __getitem__(self, i):
+        return self.left[i] @ self.right
+
+
+def _trace_block(p1, p2, table, gaps1, gaps2, i0, i1, j1, top,
+                 max_cells):
+    """
+    Trace the optimal path of the full Needleman-Wunsch matrix of p1 and p2
+    back from cell (i1, j1) until it reaches row i0. Blocks of rows with
+    more than max_cells cells are split in two: the middle row is filled in
+    linear memory, the lower half is traced first, and the upper half is
+    then traced from where the path reached the middle row. Every cell has
+    the score and back pointer it has in the full matrix, so the path is
+    the one the full matrix gives, ties included.
+    :param p1: first profile to align
+    :param p2: other profile to align
+    :param table: the scoring matrix
+    :param gaps1: the scaled PSP scores of the p1 columns against empty
+    columns
+    :param gaps2: the scaled PSP scores of the p2 columns against empty
+    columns
+    :param top: row i0 of the full matrix, up to column j1
+    :param max_cells: the largest block of back pointers to hold at once
+    :return: a tuple (path, j) with the back pointers from (i1, j1) to the
+    cell (i0, j) where the path reaches row i0, in reverse order
+    """
+    rows = i1 - i0
+    if (rows + 1) * (j1 + 1) <= max_cells or rows < 2:
+        # The PSP scores of all column pairs at once, as C1 * S * C2^T from
+        # the column counts and scoring matrix S
+        scores = (p1.counts[i0:i1] @ table
+                  @ p2.counts[:j1].T.astype(np.int64))
+        _, back = nw_numpy.fill(np.arange(rows), scores, gaps1[i0:i1],
+                                gaps2[:j1], first_row=top)
+        path = []
+        i, j = rows, j1
+        while i > 0:
+            back_pointer = back[i, j]
+            path.append(back_pointer)
+            if back_pointer != DELETE:
+                j -= 1
+            if back_pointer != INSERT:
+                i -= 1
+        return path, j
+
+    mid = (i0 + i1) // 2
+    middle, _ = nw_numpy.fill(np.arange(mid - i0),
+                              _ScoreRows(p1.counts[i0:mid], p2.counts[:j1],
+                                         table),
+                              gaps1[i0:mid], gaps2[:j1], pointers=False,
+                              last_row=True, first_row=top)
+    lower, j = _trace_block(p1, p2, table, gaps1, gaps2, mid, i1, j1, middle,
+                            max_cells)
+    upper, j = _trace_block(p1, p2, table, gaps1, gaps2, i0, mid, j,
+                            top[:j + 1], max_cells)
+    return lower + upper, j
+
+
+def profile_align(p1, p2, max_cells=MAX_CELLS, matrix=matrices.DEFAULT):
     """
     Finds an optimal global alignment of p1 and p2 using Needleman-Wunsch.
+    Alignments with more than max_cells matrix cells are traced back a block
+    of rows at a time, holding O(max_cells + n log m) cells instead of the
+    whole matrix; the alignment is the same either way.
     :param p1: first profile to align
     :param p2: other profile to align
-    :return: a tuple (score, v_aligned, w_aligned) with the optimal score
-    and aligned strings
+    :param max_cells: the largest matrix to fill in full
+    :param matrix: the name of the scoring matrix
+    :return: the profile of the combined alignment
     """
     m = len(p1)
     n = len(p2)
 
-    # Initialization; D[i][j][0] contains the max alignment score of the
-    # ith prefix of p1 and the jth of p2; D[i][j][1] contains the back pointer.
-    D = [[(0, START) for _ in range(n + 1)] for _ in range(m + 1)]
-
-    for i in range(1, m + 1):
-        D[i][0] = (D[i-1][0][0] + psp_empty(p1, i-1), DELETE)
-
-    for j in range(1, n + 1):
-        D[0][j] = (D[0][j-1][0] + psp_empty(p2, j-1), INSERT)
-
-    # Recurrence
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            insert = D[i][j - 1][0] + psp_empty(p2, j-1)
-            delete = D[i - 1][j][0] + psp_empty(p1, i-1)
-            substitute = D[i - 1][j - 1][0] + psp(p1, p2, i-1, j-1)
-
-            # Set D[i][j] to the max of the recurrences
-            if insert > delete and insert > substitute:
-                D[i][j] = (insert, INSERT)
-            elif delete > substitute:
-                D[i][j] = (delete, DELETE)
-            else:
-                D[i][j] = (substitute, SUBSTITUTE)
-
-    # Traceback
-    p1_alignments = [''] * len(p1.alignments)
-    p2_alignments = [''] * len(p2.alignments)
-    i, j = m, n
-    back_pointer = D[m][n][1]
-    while back_pointer != START:
-        if back_pointer == INSERT:
-            j -= 1
-            p1_alignments = ['-' + alignment for alignment in p1_alignments]
-            p2_alignments = [p2.alignments[k][j] + p2_alignments[k]
-                             for k in range(len(p2_alignments))]
-        elif back_pointer == DELETE:
-            i -= 1
-            p1_alignments = [p1.alignments[k][i] + p1_alignments[k]
-                             for k in range(len(p1_alignments))]
-            p2_alignments = ['-' + alignment for alignment in p2_alignments]
-
-        elif back_pointer == SUBSTITUTE:
-            i -= 1
-            j -= 1
-            p1_alignments = [p1.alignments[k][i] + p1_alignments[k]
-                             for k in range(len(p1_alignments))]
-
-            p2_alignments = [p2.alignments[k][j] + p2_alignments[k]
-                             for k in range(len(p2_alignments))]
-
-        back_pointer = D[i][j][1]
+    table = matrices.scoring_matrix(matrix)
+    gaps1, gaps2 = _scaled_gaps(p1, p2, table)
+    top = np.concatenate(([0], np.cumsum(gaps2)))
+    path, j = _trace_block(p1, p2, table, gaps1, gaps2, 0, m, n, top,
+                           max_cells)
+    # Row 0 is reached through gaps in p1 only
+    path += [INSERT] * j
+    path.reverse()
+
+    # The new column of every old column of each profile, along the path
+    path = np.array(path, dtype=np.uint8)
+    from1 = path != INSERT
+    from2 = path != DELETE
+    map1 = np.flatnonzero(from1)
+    map2 = np.flatnonzero(from2)
+
+    counts = np.zeros((len(path), len(PROTEINS)), dtype=np.uint32)
+    counts[map1] += p1.counts
+    counts[map2] += p2.counts
+    counts[~from1, GAP] += len(p1.sequences)
+    counts[~from2, GAP] += len(p2.sequences)
 
     combined = Profile(p1.sequences + p2.sequences,
-                       p1_alignments + p2_alignments)
+                       np.concatenate((map1[p1.columns], map2[p2.columns])),
+                       len(path), counts)
+
+    metrics.event('profile_align', sequences1=len(p1.sequences), columns1=m,
+                  sequences2=len(p2.sequences), columns2=n,
+                  columns=len(path))
 
     print('.', end='', flush=True)
 
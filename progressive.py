@@ -1,67 +1,179 @@
-from parse import parse_fasta
-from profile import Profile, profile_align, blosum
-from neighbor_join import construct_tree
+import argparse
+import os
+import sys
+from functools import partial
 
-START = -1
-INSERT = 0
-DELETE = 1
-SUBSTITUTE = 2
+from parse import parse_fasta
+from profile import alignment_profile, profile_align, sequence_profile
+from neighbor_join import construct_tree, read_newick
+from cache import CACHE_PATH, PairwiseCache
+from checkpoint import Checkpoint, run_key
+from distances import distance_matrix
+from encoding import UnknownResidueError, encode
+from mbed import mbed_tree
+from parallel_align import parallel_align
+from sp_score import counts_score
+import kmer
+import matrices
+import metrics
+import nw_numpy
 
 
-def align_score(v, w):
+def align_score(v, w, matrix=matrices.DEFAULT):
     """
     Finds the optimal alignment score of v and w.
     :param v: first string to align
     :param w: other string to align
+    :param matrix: the name of the scoring matrix
     :return: the score of the alignment
     """
-    m = len(v)
-    n = len(w)
-
-    # Initialization; D[i][j] contains the max alignment score of the
-    # ith prefix of v and the jth of w
-    D = [[0 for _ in range(n + 1)] for _ in range(m + 1)]
-
-    for i in range(1, m + 1):
-        D[i][0] = D[i-1][0] + blosum[v[i - 1], '-']
+    return nw_numpy.align_score(v, w, matrix)
 
-    for j in range(1, n + 1):
-        D[0][j] = D[0][j-1] + blosum['-', w[j - 1]]
 
-    # Recurrence
-    for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            insert = D[i][j - 1] + blosum['-', w[j - 1]]
-            delete = D[i - 1][j] + blosum[v[i - 1], '-']
-            substitute = D[i - 1][j - 1] + blosum[v[i - 1], w[j - 1]]
-
-            D[i][j] = max(insert, delete, substitute)
-
-    return D[m][n]
+def align_distance(v, w, matrix=matrices.DEFAULT):
+    """
+    Distance between v and w used to build the guide tree.
+    :return: the negated optimal alignment score of v and w
+    """
+    return -align_score(v, w, matrix)
 
 
-def multiple_align(node, sequences):
+def multiple_align(node, sequences, matrix=matrices.DEFAULT):
     """
     Recursively perform multiple sequence alignment along the guide tree
     :param node: the root node of the guide tree
     :param sequences: the dictionary of seqeucnes to align
+    :param matrix: the name of the scoring matrix
     :return:
     """
     if len(node.children) == 0:
-        return Profile([sequences[node.label]], [sequences[node.label]])
+        return sequence_profile(sequences[node.label])
 
-    return profile_align(multiple_align(node.children[0], sequences),
-                         multiple_align(node.children[1], sequences))
+    return profile_align(multiple_align(node.children[0], sequences, matrix),
+                         multiple_align(node.children[1], sequences, matrix),
+                         matrix=matrix)
 
 
-def main():
-    print('Reading fasta file...')
-    sequences = parse_fasta('COMP.txt')
+def add_sequences(profile, sequences, matrix=matrices.DEFAULT):
+    """
+    Add sequences to an existing alignment one at a time, aligning each to
+    the profile of the alignment so far. Only the new sequences are
+    aligned, so the existing rows keep their relative alignment.
+    :param profile: the profile of the existing alignment
+    :param sequences: the dictionary of sequences to add
+    :param matrix: the name of the scoring matrix
+    :return: the profile of the extended alignment
+    """
+    for sequence in sequences.values():
+        profile = profile_align(profile, sequence_profile(sequence),
+                                matrix=matrix)
+
+    return profile
+
+
+def read_alignment(path):
+    """
+    Read an alignment written by main(), one aligned row per line.
+    :param path: the path to the alignment
+    :return: the profile of the alignment
+    """
+    with open(path) as f:
+        rows = [line.strip() for line in f if line.strip()]
+    if not rows:
+        raise ValueError('empty alignment: {}'.format(path))
+    return alignment_profile(rows)
+
+
+def parse_args(argv=None):
+    """
+    Parse the command line options.
+    :param argv: the arguments, defaulting to sys.argv
+    :return: the parsed options
+    """
+    parser = argparse.ArgumentParser(
+        description='Progressive multiple sequence alignment.')
+    parser.add_argument('fasta', nargs='?', default='COMP.txt',
+                        help='the sequences to align')
+    parser.add_argument('--distance', choices=('exact', 'kmer'),
+                        default='exact',
+                        help='guide tree distances: exact alignment scores or '
+                             'shared k-tuple counts')
+    parser.add_argument('-k', '--kmer-size', type=int, default=kmer.K,
+                        help='k-tuple length for --distance kmer')
+    parser.add_argument('--tree', choices=('nj', 'mbed'), default='nj',
+                        help='guide tree: neighbor joining on all pairwise '
+                             'distances, or clustering of sequences embedded '
+                             'by their distances to a few seeds')
+    parser.add_argument('--matrix', choices=sorted(matrices.MATRICES),
+                        default=matrices.DEFAULT,
+                        help='the scoring matrix')
+    parser.add_argument('--guide-tree', metavar='NEWICK',
+                        help='align along this guide tree instead of '
+                             'building one; skips the distance stage')
+    parser.add_argument('--checkpoint', metavar='DIR',
+                        help='save the result of every stage to this '
+                             'directory and resume from the last completed '
+                             'stage')
+    parser.add_argument('-o', '--output', default='progressive_alignment.txt',
+                        help='where to write the alignment')
+    parser.add_argument('--add', metavar='MSA',
+                        help='add the sequences to this existing alignment '
+                             'instead of aligning them from scratch')
+    parser.add_argument('--cache', metavar='PATH', default=CACHE_PATH,
+                        help='the file caching exact distances between runs')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='compute every exact distance, without reading '
+                             'or writing the cache')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes computing exact distances and '
+                             'aligning subtrees')
+    parser.add_argument('--timing', action='store_true',
+                        help='print how long the alignment of each guide '
+                             'tree node took')
+    parser.add_argument('--metrics', metavar='PATH',
+                        help='record stage timings, DP cell counts and '
+                             'profile sizes to this file')
+    parser.add_argument('--metrics-format', choices=('jsonl', 'prometheus'),
+                        default='jsonl',
+                        help='write metrics as JSON lines or as Prometheus '
+                             'text')
+    parser.add_argument('--cprofile', metavar='STAGE', action='append',
+                        default=[],
+                        help='run a stage (parse, distances, tree, align, '
+                             'score) under cProfile; may be repeated')
+    args = parser.parse_args(argv)
+    if args.add is not None:
+        if args.checkpoint is not None:
+            parser.error('--checkpoint cannot be used with --add')
+        if os.path.realpath(args.output) == os.path.realpath(args.add):
+            parser.error('--add would overwrite {}; choose another file '
+                         'with --output'.format(args.add))
+    if not 1 <= args.kmer_size <= kmer.MAX_K:
+        parser.error('the k-tuple length must be between 1 and {}'.format(
+            kmer.MAX_K))
+    return args
 
-    print('Computing pairwise edit distances...', end='', flush=True)
-    D = {(a, b): -align_score(sequences[a], sequences[b])
-         for a in sequences for b in sequences}
-    print()
+
+def pairwise_distances(sequences, args):
+    """
+    Compute and print the distances between all pairs of sequences.
+    :param sequences: the dictionary of sequences
+    :param args: the command line options
+    :return: the distance matrix
+    """
+    if args.distance == 'kmer':
+        print('Computing k-tuple distances...', end='', flush=True)
+        D = kmer.kmer_distance_matrix(sequences, args.kmer_size)
+        print()
+    else:
+        print('Computing pairwise edit distances...', end='', flush=True)
+        cache = None if args.no_cache else PairwiseCache(args.cache)
+        distance = partial(align_distance, matrix=args.matrix)
+        D = distance_matrix(sequences, distance, args.workers, cache=cache)
+        print()
+        if cache is not None:
+            print('Distance cache:', cache.stats())
+            cache.close()
 
     for a in sequences:
         print(a, end=' ')
@@ -70,19 +182,206 @@ def main():
         print()
         print(a, end=' ')
         for b in sequences:
-            print(D[a, b], end=' ')
+            print('{:g}'.format(D[a, b]), end=' ')
 
     print()
 
-    print('Constructing guide tree...')
-    root = construct_tree(D, sequences)
+    return D
+
+
+def read_sequences(args, checkpoint=None):
+    """
+    Parse stage: read the sequences and check their residues.
+    :param args: the command line options
+    :param checkpoint: the Checkpoint of the run, or None
+    :return: the dictionary of sequences
+    """
+    if checkpoint is not None and checkpoint.done('parse'):
+        print('Reading sequences from checkpoint...')
+        return checkpoint.load_sequences()
+
+    print('Reading fasta file...')
+    try:
+        with metrics.stage('parse'):
+            sequences = parse_fasta(args.fasta)
+    except FileNotFoundError:
+        sys.exit('Error: no such file: {}'.format(args.fasta))
+
+    # Encode every sequence once up front, so that bad input is reported
+    # here rather than from deep inside an alignment
+    for name, sequence in sequences.items():
+        try:
+            encode(sequence)
+        except UnknownResidueError as error:
+            sys.exit('Error: sequence {}: {}'.format(name, error))
+
+    if checkpoint is not None:
+        checkpoint.save_sequences(sequences)
+    return sequences
+
+
+def _leaves(root):
+    labels = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.children:
+            stack.extend(node.children)
+        else:
+            labels.append(node.label)
+    return labels
+
+
+def guide_tree(sequences, args, checkpoint=None):
+    """
+    Distance and tree stages: read the guide tree given with --guide-tree,
+    or build one.
+    :param sequences: the dictionary of sequences
+    :param args: the command line options
+    :param checkpoint: the Checkpoint of the run, or None
+    :return: the root of the guide tree
+    """
+    if checkpoint is not None and checkpoint.done('tree'):
+        print('Reading guide tree from checkpoint...')
+        return checkpoint.load_tree()
+
+    if args.guide_tree is not None:
+        print('Reading guide tree...')
+        try:
+            with metrics.stage('tree'):
+                root = read_newick(args.guide_tree)
+        except (OSError, ValueError) as error:
+            sys.exit('Error: {}: {}'.format(args.guide_tree, error))
+        leaves = _leaves(root)
+        if len(leaves) != len(sequences) or set(leaves) != set(sequences):
+            sys.exit('Error: the leaves of {} are not the sequences of {}'
+                     .format(args.guide_tree, args.fasta))
+    elif args.tree == 'mbed':
+        print('Constructing guide tree by embedding...')
+        if args.distance == 'kmer':
+            distance = partial(kmer.kmer_distance, k=args.kmer_size)
+        else:
+            distance = partial(align_distance, matrix=args.matrix)
+        with metrics.stage('tree'):
+            root = mbed_tree(sequences, distance, workers=args.workers)
+    else:
+        if checkpoint is not None and checkpoint.done('distances'):
+            print('Reading distances from checkpoint...')
+            D = checkpoint.load_distances()
+        else:
+            with metrics.stage('distances'):
+                D = pairwise_distances(sequences, args)
+            if checkpoint is not None:
+                checkpoint.save_distances(D)
+        print('Constructing guide tree...')
+        with metrics.stage('tree'):
+            root = construct_tree(D, sequences)
+
+    if checkpoint is not None:
+        checkpoint.save_tree(root)
+    return root
 
+
+def run(args):
+    """
+    Run the pipeline.
+    :param args: the command line options
+    :return: nothing
+    """
+    checkpoint = None
+    if args.checkpoint is not None:
+        try:
+            key = run_key([args.fasta, args.guide_tree],
+                          distance=args.distance, kmer_size=args.kmer_size,
+                          tree=args.tree, matrix=args.matrix)
+        except FileNotFoundError as error:
+            sys.exit('Error: no such file: {}'.format(error.filename))
+        checkpoint = Checkpoint(args.checkpoint, key)
+
+    sequences = read_sequences(args, checkpoint)
+
+    if args.add is not None:
+        print('Adding sequences to {}...'.format(args.add), end='',
+              flush=True)
+        try:
+            profile = read_alignment(args.add)
+        except (OSError, ValueError) as error:
+            sys.exit('Error: {}'.format(error))
+        with metrics.stage('align'):
+            profile = add_sequences(profile, sequences, args.matrix)
+        with open(args.output, 'w') as f:
+            f.write('\n'.join(profile.alignments))
+        print()
+        with metrics.stage('score'):
+            score = counts_score(profile.counts, args.matrix)
+        print('Sum-of-Pair Score:', score)
+        return
+
+    root = guide_tree(sequences, args, checkpoint)
+
+    saved = on_done = None
+    if checkpoint is not None:
+        saved = checkpoint.saved_profiles()
+        on_done = checkpoint.save_profile
+        if saved:
+            print('Resuming from {} saved profiles'.format(len(saved)))
     print('Performing progressive alignment...', end='', flush=True)
-    profile = multiple_align(root, sequences)
-    with open('progressive_alignment.txt', 'w') as f:
+    with metrics.stage('align'):
+        profile, timings = parallel_align(root, sequences, args.workers,
+                                          args.matrix, saved, on_done)
+    if checkpoint is not None:
+        checkpoint.complete('align')
+    with open(args.output, 'w') as f:
         f.write('\n'.join(profile.alignments))
     print()
+    if checkpoint is not None and checkpoint.done('score'):
+        score = checkpoint.value('score', 'score')
+    else:
+        with metrics.stage('score'):
+            score = counts_score(profile.counts, args.matrix)
+        if checkpoint is not None:
+            checkpoint.complete('score', score=score)
+    print('Sum-of-Pair Score:', score)
+
+    if args.timing:
+        print('Node timings (sequences, seconds, node):')
+        for node, seconds in timings:
+            label = node.label
+            if len(label) > 60:
+                label = label[:57] + '...'
+            print('{:6d} {:8.3f}  {}'.format(node.label.count(',') + 1,
+                                             seconds, label))
+
+
+def pooled_stages(args):
+    """
+    List the stages whose work runs in worker processes, which cProfile in
+    this process does not see.
+    :param args: the command line options
+    :return: the set of stage names
+    """
+    if args.workers == 1:
+        return set()
+    stages = {'align'}
+    if args.tree == 'mbed':
+        stages.add('tree')
+    elif args.distance == 'exact':
+        stages.add('distances')
+    return stages
+
 
+def main(argv=None):
+    args = parse_args(argv)
+    if args.metrics is not None:
+        for stage in sorted(set(args.cprofile) & pooled_stages(args)):
+            print('Warning: the {} stage runs in worker processes, which '
+                  '--cprofile does not profile; use --workers 1 to profile '
+                  'it'.format(stage), file=sys.stderr)
+        metrics.enable(args.metrics, args.metrics_format, args.cprofile)
+    try:
+        run(args)
+    finally:
+        metrics.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
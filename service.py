@@ -0,0 +1,448 @@
+"""
+Local alignment service, to align from other programs without paying the
+start up cost of a new process for every job.
+Usage: python3 service.py [--host 127.0.0.1] [--port 8765] [--unix PATH]
+                          [--workers N] [--queue-size 64] [--timeout 60]
+
+The service speaks plain HTTP over TCP or a Unix socket:
+
+    POST /align   run a job, given as a JSON object
+    GET /health   report the queue, the workers and the cache
+
+A job has a "type", "pairwise", "center-star" or "progressive", and its
+"sequences", either a list of sequences or an object name -> sequence;
+pairwise jobs take exactly two, and a list names its sequences "1", "2"
+and so on. Optional fields are "matrix", the name of the scoring matrix,
+"band" for pairwise jobs, "distance" ("exact" or "kmer") for progressive
+jobs, and "timeout" in seconds, which can only shorten the service's own
+and counts from when the job is queued. The response holds the aligned
+rows as "alignment", the names of their sequences in the same order as
+"names", as the aligners may reorder the rows, and their score as "score":
+the alignment score of a pairwise job and the Sum-of-Pair score otherwise.
+
+Jobs run in a pool of worker processes that load every scoring matrix when
+they start. Jobs wait for a worker in a bounded queue; once it is full new
+jobs are turned away with 503 and a Retry-After header until it drains. A
+job that runs past its timeout is answered with 504, but its worker still
+finishes it, as a running process cannot be interrupted; the worker only
+takes another job then. The results of the last jobs are cached, so a
+repeated job is answered without running it again.
+"""
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from hashlib import sha256
+import io
+import json
+import multiprocessing
+import os
+import signal
+
+from batch import align_family
+from encoding import encode
+import matrices
+import nw_numpy
+from sp_score import sp_score
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+JOB_TYPES = ('pairwise', 'center-star', 'progressive')
+
+# Jobs waiting for a worker, seconds a job may take, and results kept
+QUEUE_SIZE = 64
+TIMEOUT = 60
+CACHE_SIZE = 256
+
+# Largest request body accepted, in bytes
+MAX_BODY = 64 << 20
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 413: 'Payload Too Large',
+            500: 'Internal Server Error', 503: 'Service Unavailable',
+            504: 'Gateway Timeout'}
+
+
+def _init_worker():
+    for name in matrices.MATRICES:
+        matrices.scoring_matrix(name)
+        matrices.gap_scores(name)
+
+
+def parse_job(data):
+    """
+    Check a job and fill in its defaults.
+    :param data: the decoded JSON of the job
+    :return: the job as a dictionary with every field set
+    :raises ValueError: if the job is not valid
+    """
+    if not isinstance(data, dict):
+        raise ValueError('a job must be a JSON object')
+    kind = data.get('type')
+    if kind not in JOB_TYPES:
+        raise ValueError('job type must be one of {}'.format(
+            ', '.join(JOB_TYPES)))
+
+    sequences = data.get('sequences')
+    if isinstance(sequences, list):
+        sequences = {str(k + 1): sequence
+                     for k, sequence in enumerate(sequences)}
+    if not isinstance(sequences, dict) or not sequences or not all(
+            isinstance(sequence, str) and sequence
+            for sequence in sequences.values()):
+        raise ValueError('sequences must be a non-empty list or object of '
+                         'non-empty strings')
+    sequences = {name: sequence.upper()
+                 for name, sequence in sequences.items()}
+    for name, sequence in sequences.items():
+        try:
+            encode(sequence)
+        except ValueError as error:
+            raise ValueError('sequence {}: {}'.format(name, error))
+    if kind == 'pairwise' and len(sequences) != 2:
+        raise ValueError('a pairwise job takes exactly two sequences')
+
+    matrix = data.get('matrix', matrices.DEFAULT)
+    if matrix not in matrices.MATRICES:
+        raise ValueError('unknown scoring matrix {!r}'.format(matrix))
+    band = data.get('band')
+    if band is not None and band != 'auto' and not (
+            isinstance(band, int) and not isinstance(band, bool)
+            and band > 0):
+        raise ValueError("band must be 'auto' or a positive integer")
+    distance = data.get('distance', 'exact')
+    if distance not in ('exact', 'kmer'):
+        raise ValueError("distance must be 'exact' or 'kmer'")
+    timeout = data.get('timeout')
+    if timeout is not None and not (isinstance(timeout, (int, float))
+                                    and timeout > 0):
+        raise ValueError('timeout must be a positive number of seconds')
+
+    return {'type': kind, 'sequences': sequences, 'matrix': matrix,
+            'band': band, 'distance': distance, 'timeout': timeout}
+
+
+def job_key(job):
+    """
+    Compute the cache key of a job from the fields that decide its result.
+    """
+    fields = {name: value for name, value in job.items() if name != 'timeout'}
+    return sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()
+
+
+def run_job(job):
+    """
+    Run a job; called in the worker processes.
+    :param job: the job returned by parse_job()
+    :return: a dictionary with the names of the sequences, their aligned
+    rows in the same order and the score of the rows: the alignment score of
+    a pairwise job, the Sum-of-Pair score otherwise
+    """
+    sequences = job['sequences']
+    matrix = job['matrix']
+    # The aligners print progress dots
+    with redirect_stdout(io.StringIO()):
+        if job['type'] == 'pairwise':
+            rows = list(nw_numpy.sequence_align(*sequences.values(),
+                                                job['band'], matrix))
+            table = matrices.scoring_matrix(matrix)
+            return {'names': list(sequences), 'alignment': rows,
+                    'score': int(table[encode(rows[0]),
+                                       encode(rows[1])].sum())}
+        else:
+            method = 'center' if job['type'] == 'center-star' \
+                else 'progressive'
+            aligned = align_family(sequences, method, job['distance'],
+                                   matrix)
+
+    rows = list(aligned.values())
+    return {'names': list(aligned), 'alignment': rows,
+            'score': sp_score(rows, matrix)}
+
+
+class Busy(Exception):
+    """
+    Raised when the job queue is full.
+    """
+
+
+class AlignmentService:
+    def __init__(self, workers=None, queue_size=QUEUE_SIZE, timeout=TIMEOUT,
+                 cache_size=CACHE_SIZE):
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.queue = asyncio.Queue(queue_size)
+        self.executor = None
+        self.dispatchers = []
+        self.running = 0
+        self.stats = {'completed': 0, 'failed': 0, 'rejected': 0,
+                      'timed_out': 0, 'cache_hits': 0}
+
+    async def start(self):
+        """
+        Start the worker processes and the tasks feeding them jobs.
+        """
+        # Forked workers would inherit the sockets of open connections and
+        # keep them from closing
+        self.executor = ProcessPoolExecutor(
+            self.workers, multiprocessing.get_context('spawn'),
+            initializer=_init_worker)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.executor, os.getpid)
+                               for _ in range(self.workers)))
+        self.dispatchers = [asyncio.create_task(self._dispatch())
+                            for _ in range(self.workers)]
+
+    async def close(self):
+        """
+        Stop taking jobs and shut the worker processes down, without waiting
+        for the jobs they are running.
+        """
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _dispatch(self):
+        # One dispatcher per worker process, so that jobs wait in the
+        # bounded queue rather than in the executor
+        loop = asyncio.get_running_loop()
+        while True:
+            key, job, future = await self.queue.get()
+            if future.done():
+                # Timed out while queued
+                continue
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(self.executor, run_job,
+                                                    job)
+            except Exception as error:
+                self.stats['failed'] += 1
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                self.stats['completed'] += 1
+                self._store(key, result)
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+
+    def _store(self, key, result):
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def submit(self, job):
+        """
+        Run a job in a worker, or take its result from the cache.
+        :param job: the job returned by parse_job()
+        :return: the result of run_job()
+        :raises Busy: if the queue is full
+        :raises asyncio.TimeoutError: if the job takes longer than its
+        timeout
+        """
+        key = job_key(job)
+        if key in self.cache:
+            self.stats['cache_hits'] += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((key, job, future))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise Busy()
+
+        timeout = self.timeout
+        if job['timeout'] is not None:
+            timeout = min(timeout, job['timeout'])
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self.stats['timed_out'] += 1
+            raise
+
+    def health(self):
+        """
+        Report the state of the service.
+        """
+        return {'status': 'ok', 'workers': self.workers,
+                'queued': self.queue.qsize(), 'queue_size': self.queue.maxsize,
+                'running': self.running, 'cached': len(self.cache),
+                **self.stats}
+
+    async def handle(self, reader, writer):
+        """
+        Answer one HTTP request on a connection.
+        """
+        headers = {}
+        try:
+            status, body = await self._respond(reader)
+        except Exception as error:
+            status, body = 500, {'error': str(error)}
+        if status == 503:
+            headers['Retry-After'] = '1'
+
+        payload = json.dumps(body).encode()
+        lines = ['HTTP/1.1 {} {}'.format(status, _REASONS[status]),
+                 'Content-Type: application/json',
+                 'Content-Length: {}'.format(len(payload)),
+                 'Connection: close']
+        lines.extend('{}: {}'.format(name, value)
+                     for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _respond(self, reader):
+        request = (await reader.readline()).decode('latin-1').split()
+        if len(request) != 3:
+            return 400, {'error': 'malformed request line'}
+        method, target, _ = request
+
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                try:
+                    length = int(value)
+                except ValueError:
+                    return 400, {'error': 'bad Content-Length'}
+
+        if target == '/health':
+            if method != 'GET':
+                return 405, {'error': 'use GET'}
+            return 200, self.health()
+        if target != '/align':
+            return 404, {'error': 'no such endpoint: {}'.format(target)}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        if length > MAX_BODY:
+            return 413, {'error': 'request body over {} bytes'.format(
+                MAX_BODY)}
+
+        try:
+            job = parse_job(json.loads(await reader.readexactly(length)))
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        except asyncio.IncompleteReadError:
+            return 400, {'error': 'request body shorter than Content-Length'}
+
+        try:
+            return 200, await self.submit(job)
+        except Busy:
+            return 503, {'error': 'job queue full, retry later'}
+        except asyncio.TimeoutError:
+            return 504, {'error': 'job timed out'}
+
+
+async def serve(service, host=HOST, port=PORT, unix=None, ready=None):
+    """
+    Run the service until the task is cancelled or the process receives
+    SIGINT or SIGTERM.
+    :param service: the AlignmentService
+    :param host: the address to listen on
+    :param port: the TCP port, 0 for any free port
+    :param unix: the path of a Unix socket to listen on instead of TCP
+    :param ready: an optional function called with the listening server
+    :return: nothing
+    """
+    await service.start()
+    if unix is not None:
+        server = await asyncio.start_unix_server(service.handle, unix)
+    else:
+        server = await asyncio.start_server(service.handle, host, port)
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(number, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    if ready is not None:
+        ready(server)
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        await service.close()
+        if unix is not None and os.path.exists(unix):
+            os.remove(unix)
+
+
+async def request(job, host=HOST, port=PORT, unix=None, method='POST',
+                  target='/align'):
+    """
+    Send a job to a running service.
+    :param job: the job as a dictionary, None for a request without a body
+    :param host: the address of the service
+    :param port: its TCP port
+    :param unix: the path of its Unix socket, to connect to instead of TCP
+    :param method: the HTTP method
+    :param target: the endpoint
+    :return: a tuple (status, response) with the HTTP status code and the
+    decoded JSON response
+    """
+    if unix is not None:
+        reader, writer = await asyncio.open_unix_connection(unix)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+
+    body = b'' if job is None else json.dumps(job).encode()
+    writer.write('{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: '
+                 'application/json\r\nContent-Length: {}\r\n\r\n'
+                 .format(method, target, host, len(body)).encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    head, _, payload = response.partition(b'\r\n\r\n')
+    status = int(head.split(None, 2)[1])
+    return status, json.loads(payload)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Local alignment service.')
+    parser.add_argument('--host', default=HOST,
+                        help='the address to listen on')
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='the TCP port to listen on')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on this Unix socket instead of TCP')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, one per CPU by default')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help='jobs that may wait for a worker')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='seconds a job may take')
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE,
+                        help='job results kept for repeated jobs')
+    args = parser.parse_args(argv)
+
+    service = AlignmentService(args.workers, args.queue_size, args.timeout,
+                               args.cache_size)
+    where = args.unix or '{}:{}'.format(args.host, args.port)
+    asyncio.run(serve(service, args.host, args.port, args.unix,
+                      lambda server: print('Listening on', where,
+                                           flush=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,111 @@
 """
 Script to compute the Sum-of-Pair score of a multiple sequence alignment.
+Usage: python3 sp_score.py msa_file [--matrix NAME]
+
+The score sums the scoring matrix over every ordered pair of rows, a row
+paired with itself included, in every column. It only depends on how many
+times each residue occurs in each column: with c the vector of residue
+counts of a column and S the scoring matrix, the column scores c^T S c.
 """
 
+import argparse
+
+import numpy as np
+
+from encoding import PROTEINS, encode_rows
+import matrices
+
+# Number of alignment rows read at a time, and number of columns scored at a
+# time
+CHUNK_ROWS = 1024
+BLOCK_COLUMNS = 4096
+
+
+def add_counts(counts, alignments):
+    """
+    Add the residues of aligned rows to column counts.
+    :param counts: an L x 24 array of counts, updated in place; None to
+    create it
+    :param alignments: a list of aligned rows of the same length L
+    :return: the updated counts
+    :raises ValueError: if the rows have different lengths
+    """
+    length = len(alignments[0])
+    if counts is None:
+        counts = np.zeros((length, len(PROTEINS)), dtype=np.int64)
+    elif len(counts) != length:
+        raise ValueError('rows of different lengths in the alignment')
+
+    cells = encode_rows(alignments) + len(PROTEINS) * np.arange(length)
+    counts += np.bincount(cells.ravel(),
+                          minlength=counts.size).reshape(counts.shape)
+    return counts
+
+
+def counts_score(counts, matrix=matrices.DEFAULT):
+    """
+    Compute the Sum-of-Pair score of an alignment from its column counts.
+    :param counts: an L x 24 array with the number of times each residue
+    occurs in each column
+    :param matrix: the name of the scoring matrix
+    :return: the score
+    """
+    table = matrices.scoring_matrix(matrix)
+    score = 0
+    for start in range(0, len(counts), BLOCK_COLUMNS):
+        block = counts[start:start + BLOCK_COLUMNS].astype(np.int64)
+        score += int(((block @ table) * block).sum())
+    return score
+
+
+def sp_score(alignments, matrix=matrices.DEFAULT):
+    """
+    Compute the Sum-of-Pair score of a multiple sequence alignment.
+    :param alignments: the list of aligned rows
+    :param matrix: the name of the scoring matrix
+    :return: the score
+    """
+    if len(alignments) == 0:
+        return 0
+    return counts_score(add_counts(None, alignments), matrix)
+
+
+def sp_score_file(path, matrix=matrices.DEFAULT, chunk_rows=CHUNK_ROWS):
+    """
+    Compute the Sum-of-Pair score of an alignment file with one aligned row
+    per line, reading chunk_rows rows at a time.
+    :param path: the path to the file
+    :param matrix: the name of the scoring matrix
+    :param chunk_rows: the number of rows held in memory at a time
+    :return: the score
+    """
+    counts = None
+    chunk = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                chunk.append(line)
+            if len(chunk) == chunk_rows:
+                counts = add_counts(counts, chunk)
+                chunk = []
+    if chunk:
+        counts = add_counts(counts, chunk)
+
+    return 0 if counts is None else counts_score(counts, matrix)
 
-from profile import blosum
-import sys
 
-if len(sys.argv) != 2:
-    print('Usage: python3 sp_score.py msa_file')
-    exit()
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Sum-of-Pair score of a multiple sequence alignment.')
+    parser.add_argument('msa_file', help='the alignment, one row per line')
+    parser.add_argument('--matrix', choices=sorted(matrices.MATRICES),
+                        default=matrices.DEFAULT,
+                        help='the scoring matrix')
+    args = parser.parse_args(argv)
 
-with open(sys.argv[1]) as f:
-    alignments = [line.strip() for line in f.readlines()]
+    print('Sum-of-Pair Score:', sp_score_file(args.msa_file, args.matrix))
 
-sp_score = 0
-for x in alignments:
-    for y in alignments:
-        for xi, yi in zip(x, y):
-            sp_score += blosum[xi, yi]
 
-print('Sum-of-Pair Score:', sp_score)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""
+Tests that banded alignments are the alignments of the full matrix, not
+only alignments with the same score.
+"""
+
+import random
+
+import pytest
+
+import align
+import nw_numpy
+
+
+def _pairs(count, alphabet, longest, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield (''.join(rng.choice(alphabet)
+                       for _ in range(rng.randint(0, longest))),
+               ''.join(rng.choice(alphabet)
+                       for _ in range(rng.randint(0, longest))))
+
+
+def test_tie_outside_band():
+    # A path leaving the band ties the optimum; the full matrix traces it
+    full = align.pairwise('NNRNADDADADDADD', 'ADANNN', 0, 3, 1)
+    assert full == (15, '---NNRNADDADADDADD', 'ADANN-N-----------')
+    assert align.pairwise('NNRNADDADADDADD', 'ADANNN', 0, 3, 1, 1) == full
+
+
+@pytest.mark.parametrize('band', [1, 2, 'auto'])
+def test_pairwise(band):
+    for v, w in _pairs(1000, 'ADNR', 16):
+        assert align.pairwise(v, w, 0, 3, 1, band) \
+            == align.pairwise(v, w, 0, 3, 1)
+
+
+@pytest.mark.parametrize('band', [1, 2, 'auto'])
+def test_sequence_align(band):
+    for v, w in _pairs(1000, 'ACDEGHKW', 30, seed=1):
+        assert nw_numpy.sequence_align(v, w, band) \
+            == nw_numpy.sequence_align(v, w)
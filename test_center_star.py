@@ -0,0 +1,51 @@
+"""
+Tests that fix the center star alignments of the bundled families, merged
+from the column maps of the pairwise alignments to the center.
+"""
+
+from hashlib import sha256
+import os
+
+import pytest
+
+from centerStar import centerStar_align
+from parse import parse_fasta
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Center sequence and digest of the alignment as centerStar.main() writes it
+_EXPECTED = {
+    'small.txt': ('HOMO SAPIENS', 'bb8f577933552e5feafb57b77ff1b205'
+                                  'e73ae994dac401d78ab6b4cba085173a'),
+    'COMP.txt': ('HOMO SAPIENS', '141d1ab8f7bf0a64bf3213786c385782'
+                                 'b162107e1acea7dd64e5f37ef736e6cd'),
+    'NCAM1.txt': ('MACACA MULATTA', '5ebf1bb2835d3de20eac6d0912d50437'
+                                    '7635415c87edacbcd8be7edd67e63e9f'),
+}
+
+
+def _align(name):
+    sequences = parse_fasta(os.path.join(_DIRECTORY, name))
+    center, _ = _EXPECTED[name]
+    return sequences, centerStar_align(center, dict(sequences))
+
+
+@pytest.mark.parametrize('name', sorted(_EXPECTED))
+def test_bundled_families(name):
+    sequences, alignment = _align(name)
+    assert len(set(map(len, alignment.values()))) == 1
+    assert {key: row.replace('-', '') for key, row in alignment.items()} \
+        == sequences
+
+    text = '\n'.join('{}: {}'.format(key, value)
+                     for key, value in alignment.items())
+    assert sha256(text.encode()).hexdigest() == _EXPECTED[name][1]
+
+
+def test_gaps_stay_in_place():
+    # Gaps a row got from its own alignment to the center are kept where
+    # they are; the second DP pass used to slide residues across them
+    _, alignment = _align('small.txt')
+    assert 'EIVFLKNTVMECEACGE----K-' in alignment['DANIO RERIO']
+    _, alignment = _align('NCAM1.txt')
+    assert 'T--R-P----EKQE---' in alignment['HOMO SAPIENS']
@@ -0,0 +1,30 @@
+"""
+Tests of the k-tuple distances, including sequences shorter than k.
+"""
+
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from kmer import _tuples, kmer_distance, kmer_distance_matrix
+
+_SEQUENCES = {'short': 'MKV', 'single': 'M', 'long': 'MKVLAAGICKWSMKV',
+              'other': 'MKVLSAGICRWSMKVLA'}
+
+
+@pytest.mark.parametrize('k', [1, 2, 3, 4, 5])
+def test_short_sequences(k):
+    for sequence in _SEQUENCES.values():
+        assert len(_tuples(sequence, k)) == max(len(sequence) - k + 1, 0)
+
+    D = kmer_distance_matrix(_SEQUENCES, k)
+    for (i, v), (j, w) in combinations(enumerate(_SEQUENCES.values()), 2):
+        assert D.matrix[i, j] == pytest.approx(kmer_distance(v, w, k))
+        assert D.matrix[j, i] == D.matrix[i, j]
+    assert np.all(np.diag(D.matrix) == 0)
+
+
+def test_no_shared_tuples():
+    assert kmer_distance('MKV', 'MKVLA', 5) == 1
+    assert kmer_distance('MKVLA', 'MKVLA', 5) == 0
@@ -0,0 +1,50 @@
+"""
+Tests of the bit-parallel edit distance against the Needleman-Wunsch
+reference in centerStar.pairwise.
+"""
+
+from itertools import combinations
+import os
+
+import pytest
+
+from centerStar import pairwise
+from myers import edit_distance
+from parse import parse_fasta
+
+_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def _pairs(name):
+    sequences = parse_fasta(os.path.join(_DIRECTORY, name))
+    return list(combinations(sequences.values(), 2))
+
+
+@pytest.mark.parametrize('name', ['small.txt', 'COMP.txt', 'NCAM1.txt'])
+def test_bundled_families(name):
+    for v, w in _pairs(name):
+        expected = pairwise(v, w)
+        assert edit_distance(v, w) == expected
+        assert edit_distance(w, v) == expected
+
+
+@pytest.mark.parametrize('v, w', [
+    ('', ''),
+    ('', 'A'),
+    ('A', ''),
+    ('', 'ACDE'),
+    ('A', 'A'),
+    ('A', 'C'),
+    ('A', 'CAC'),
+    ('ACDE', 'A'),
+])
+def test_edge_cases(v, w):
+    assert edit_distance(v, w) == pairwise(v, w)
+
+
+def test_word_boundaries():
+    # Patterns around the lengths where the bit vectors grow a word
+    for m in (63, 64, 65, 127, 128, 129):
+        v = ('ACDEFGHIKLMNPQRSTVWY' * 7)[:m]
+        w = v[::2] + 'W' * (m // 3)
+        assert edit_distance(v, w) == pairwise(v, w)
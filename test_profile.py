@@ -0,0 +1,45 @@
+"""
+Tests that profile alignments do not depend on whether they are traced back
+from the full matrix or a block of rows at a time.
+"""
+
+import random
+
+import pytest
+
+from benchmark import random_family
+from profile import profile_align, sequence_profile
+
+
+def _profile(sequences):
+    profile = sequence_profile(sequences[0])
+    for sequence in sequences[1:]:
+        profile = profile_align(profile, sequence_profile(sequence), 10 ** 9)
+    return profile
+
+
+def _profile_pairs(count, seed=0):
+    rng = random.Random(seed)
+    for k in range(count):
+        family = list(random_family(rng.randint(2, 6), rng.randint(5, 60),
+                                    rng.choice((0.1, 0.3, 0.6)), k).values())
+        split = rng.randint(1, len(family) - 1)
+        yield _profile(family[:split]), _profile(family[split:])
+
+
+@pytest.mark.parametrize('max_cells', [4, 20, 100, 500])
+def test_blocks_match_full_matrix(max_cells):
+    for p1, p2 in _profile_pairs(150):
+        full = profile_align(p1, p2, 10 ** 9)
+        blocks = profile_align(p1, p2, max_cells)
+        assert blocks.alignments == full.alignments
+
+
+def test_empty_profile():
+    p1 = sequence_profile('')
+    p2 = sequence_profile('ACDE')
+    for max_cells in (1, 10 ** 9):
+        assert profile_align(p1, p2, max_cells).alignments == ['----',
+                                                               'ACDE']
+        assert profile_align(p2, p1, max_cells).alignments == ['ACDE',
+                                                               '----']
@@ -0,0 +1,96 @@
+"""
+Tests of the alignment service, run on localhost.
+"""
+
+import asyncio
+import random
+
+from service import AlignmentService, request, serve
+
+
+def _run(check, **options):
+    """
+    Start a service on a free port, run check(port) against it and stop it.
+    """
+    async def main():
+        service = AlignmentService(workers=1, **options)
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(serve(
+            service, port=0, ready=lambda server: started.set_result(
+                server.sockets[0].getsockname()[1])))
+        port = await asyncio.wait_for(started, 60)
+        try:
+            return await check(port)
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+def _long_pair(seed):
+    rng = random.Random(seed)
+    return [''.join(rng.choice('ACDEFGHIKLMNPQRSTVWY') for _ in range(5000))
+            for _ in range(2)]
+
+
+def test_results_and_cache():
+    async def check(port):
+        job = {'type': 'center-star',
+               'sequences': {'a': 'MKVLAAGIC', 'b': 'MKVAGIC', 'c': 'MKVLAGIC'}}
+        status, first = await request(job, port=port)
+        assert status == 200
+        assert sorted(first['names']) == ['a', 'b', 'c']
+        for name, row in zip(first['names'], first['alignment']):
+            assert row.replace('-', '') == job['sequences'][name]
+
+        status, second = await request(job, port=port)
+        assert (status, second) == (200, first)
+        status, health = await request(None, port=port, method='GET',
+                                       target='/health')
+        assert health['cache_hits'] == 1 and health['completed'] == 1
+
+        status, pair = await request({'type': 'pairwise',
+                                      'sequences': ['MKVL', 'MKL']},
+                                     port=port)
+        assert status == 200
+        assert pair['names'] == ['1', '2']
+        assert pair['alignment'] == ['MKVL', 'MK-L']
+
+    _run(check)
+
+
+def test_bad_residue():
+    async def check(port):
+        status, response = await request(
+            {'type': 'pairwise', 'sequences': ['MKVL', 'MK1L']}, port=port)
+        assert status == 400
+        assert 'sequence 2' in response['error']
+
+    _run(check)
+
+
+def test_queue_full():
+    async def check(port):
+        jobs = [{'type': 'pairwise', 'sequences': _long_pair(seed)}
+                for seed in range(4)]
+        statuses = [status for status, _ in await asyncio.gather(
+            *(request(job, port=port) for job in jobs))]
+        # One job runs and one waits; the others are turned away
+        assert statuses.count(503) >= 1
+        assert statuses.count(200) >= 1
+
+    _run(check, queue_size=1)
+
+
+def test_timeout():
+    async def check(port):
+        status, response = await request(
+            {'type': 'pairwise', 'sequences': _long_pair(0),
+             'timeout': 0.01}, port=port)
+        assert status == 504
+        status, health = await request(None, port=port, method='GET',
+                                       target='/health')
+        assert health['timed_out'] == 1
+
+    _run(check)